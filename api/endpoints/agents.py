@@ -1,12 +1,16 @@
 # api/endpoints/agents.py
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query
 from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import Float, cast, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from db.database import get_db
 import db.models as models
-from auth.security import get_password_hash, get_current_admin
+from db.models import ClientType, FinalStatus
+from auth.security import get_password_hash, get_current_admin, get_current_agent
+from services.cache import agent_directory, leaderboard_cache
 
 
 router = APIRouter(prefix="/agents", tags=["agents"])
@@ -39,6 +43,16 @@ class AgentRead(AgentBase):
         from_attributes = True   # ou orm_mode = True si Pydantic v1
 
 
+class AgentSummary(BaseModel):
+    # version courte embarquée dans les call sessions (?include=agent)
+    id: int
+    email: str
+    number: str
+
+    class Config:
+        from_attributes = True
+
+
 class AdminCreate(BaseModel):
     number: str
     email: EmailStr
@@ -46,6 +60,65 @@ class AdminCreate(BaseModel):
     role: str  # "agent" ou "admin"
 
 
+class LeaderboardEntry(BaseModel):
+    rank: int
+    agent_id: int
+    email: str
+    number: str
+    total: int
+    satisfied: int
+    not_satisfied: int
+    satisfaction_rate: Optional[float] = None  # satisfied / sessions clôturées
+    company: int
+    individual: int
+
+
+class Leaderboard(BaseModel):
+    total_agents: int
+    items: List[LeaderboardEntry]
+
+
+# --------- HELPERS ---------
+
+AGENTS = models.Agent.__table__
+
+
+def _is_email_conflict(error: IntegrityError) -> bool:
+    # violation de l'unicité de agents.email (index créé par create_all,
+    # ou contrainte si la table a été créée à la main)
+    diag = getattr(error.orig, "diag", None)
+    return getattr(diag, "constraint_name", None) in ("ix_agents_email", "agents_email_key")
+
+
+# --------- AGENT DIRECTORY ---------
+
+def agent_summaries(db: Session, agent_ids: Iterable[int]) -> Dict[int, dict]:
+    """
+    id -> AgentSummary dict for every known id. Served from the in-process
+    directory when possible; all misses are fetched in one IN query.
+    """
+    found: Dict[int, dict] = {}
+    missing = []
+    for agent_id in set(agent_ids):
+        cached = agent_directory.get(agent_id) if agent_directory.ttl > 0 else None
+        if cached is not None:
+            found[agent_id] = cached
+        else:
+            missing.append(agent_id)
+
+    if missing:
+        rows = db.execute(
+            select(models.Agent.id, models.Agent.email, models.Agent.number)
+            .where(models.Agent.id.in_(missing))
+        ).mappings()
+        for row in rows:
+            summary = dict(row)
+            found[summary["id"]] = summary
+            if agent_directory.ttl > 0:
+                agent_directory.set(summary["id"], summary)
+    return found
+
+
 # --------- ROUTES ---------
 
 # CREATE
@@ -60,31 +133,32 @@ def test_agent_route():
     status_code=status.HTTP_201_CREATED,
 )
 def create_agent(agent_in: AgentCreate, db: Session = Depends(get_db)):
-    # vérifier si l'email existe déjà
-    existing_agent = (
-        db.query(models.Agent)
-        .filter(models.Agent.email == agent_in.email)
-        .first()
-    )
-    if existing_agent:
+    # créer l'agent avec mot de passe hashé
+    #hashed_password = get_password_hash(agent_in.password)
+
+    # INSERT ... RETURNING : l'unicité de l'email est vérifiée par l'index
+    # unique, pas par un SELECT préalable
+    try:
+        agent = db.execute(
+            insert(AGENTS)
+            .values(
+                number=agent_in.number,
+                email=agent_in.email,
+                password=agent_in.password,  #hashed_password
+                role=agent_in.role,
+            )
+            .returning(*AGENTS.c)
+        ).one()
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if not _is_email_conflict(e):
+            raise
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email déjà utilisé",
         )
-
-    # créer l'agent avec mot de passe hashé
-    #hashed_password = get_password_hash(agent_in.password)
-
-    agent = models.Agent(
-        number=agent_in.number,
-        email=agent_in.email,
-        password=agent_in.password,  #hashed_password
-        role=agent_in.role
-    )
-
-    db.add(agent)
-    db.commit()
-    db.refresh(agent)
+    leaderboard_cache.clear()
 
     return agent
 
@@ -96,6 +170,88 @@ def list_agents(db: Session = Depends(get_db)):
     return agents
 
 
+def _leaderboard_query(skip: int, limit: int):
+    """
+    One statement: per-agent aggregates (FILTER), joined to agents, ranked
+    with window functions, then paginated.
+    """
+    CS = models.CallSession
+    per_agent = (
+        select(
+            CS.agent_id.label("agent_id"),
+            func.count(CS.id).label("total"),
+            func.count(CS.id).filter(CS.final_status == FinalStatus.SATISFIED).label("satisfied"),
+            func.count(CS.id).filter(CS.final_status == FinalStatus.NOT_SATISFIED).label("not_satisfied"),
+            func.count(CS.id).filter(CS.client_type == ClientType.COMPANY).label("company"),
+            func.count(CS.id).filter(CS.client_type == ClientType.INDIVIDUAL).label("individual"),
+        )
+        .group_by(CS.agent_id)
+        .subquery()
+    )
+
+    total = func.coalesce(per_agent.c.total, 0)
+    satisfied = func.coalesce(per_agent.c.satisfied, 0)
+    not_satisfied = func.coalesce(per_agent.c.not_satisfied, 0)
+    rate = cast(satisfied, Float) / func.nullif(satisfied + not_satisfied, 0)
+
+    ranked = (
+        select(
+            models.Agent.id.label("agent_id"),
+            models.Agent.email,
+            models.Agent.number,
+            total.label("total"),
+            satisfied.label("satisfied"),
+            not_satisfied.label("not_satisfied"),
+            func.coalesce(per_agent.c.company, 0).label("company"),
+            func.coalesce(per_agent.c.individual, 0).label("individual"),
+            rate.label("satisfaction_rate"),
+            func.rank().over(order_by=(rate.desc().nullslast(), total.desc())).label("rank"),
+            func.count().over().label("total_agents"),
+        )
+        .outerjoin(per_agent, per_agent.c.agent_id == models.Agent.id)
+        .subquery()
+    )
+
+    return (
+        select(ranked)
+        .order_by(ranked.c.rank, ranked.c.agent_id)
+        .offset(skip)
+        .limit(limit)
+    )
+
+
+# LEADERBOARD (taux de satisfaction par agent)
+@router.get(
+    "/leaderboard",
+    response_model=Leaderboard,
+    description="Ranks agents on live call sessions; archived sessions are not counted.",
+)
+def get_leaderboard(
+    skip: int = Query(0, ge=0, description="Number of agents to skip"),
+    limit: int = Query(50, ge=1, le=1000, description="Top-k / page size"),
+    db: Session = Depends(get_db),
+    current_agent: models.Agent = Depends(get_current_agent),
+):
+    key = (skip, limit)
+    cached = leaderboard_cache.get(key)
+    if cached is not None:
+        return cached
+
+    rows = db.execute(_leaderboard_query(skip, limit)).mappings().all()
+    if rows:
+        total_agents = rows[0]["total_agents"]
+    else:
+        # page au-delà de la fin : on a quand même besoin du total
+        total_agents = db.query(func.count(models.Agent.id)).scalar()
+
+    leaderboard = Leaderboard(
+        total_agents=total_agents,
+        items=[LeaderboardEntry(**row) for row in rows],
+    )
+    leaderboard_cache.set(key, leaderboard)
+    return leaderboard
+
+
 # GET by id
 @router.get("/agent/id/{agent_id}", response_model=AgentRead)
 def get_agent(agent_id: int, db: Session = Depends(get_db)):
@@ -124,41 +280,47 @@ def update_agent(
     agent_in: AgentUpdate,
     db: Session = Depends(get_db),
 ):
-    agent = db.query(models.Agent).filter(models.Agent.id == agent_id).first()
-    if not agent:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Agent non trouvé",
-        )
-
-    # si email envoyé, vérifier qu'il n'est pas utilisé par un autre agent
-    if agent_in.email:
-        existing_agent = (
-            db.query(models.Agent)
-            .filter(
-                models.Agent.email == agent_in.email,
-                models.Agent.id != agent_id,
-            )
-            .first()
-        )
-        if existing_agent:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email déjà utilisé par un autre agent",
-            )
-
     # appliquer seulement les champs présents
+    values = {}
     if agent_in.number is not None:
-        agent.number = agent_in.number
+        values["number"] = agent_in.number
     if agent_in.email is not None:
-        agent.email = agent_in.email
+        values["email"] = agent_in.email
     if agent_in.password is not None:
-        agent.password = get_password_hash(agent_in.password)
+        values["password"] = get_password_hash(agent_in.password)
     if agent_in.role is not None:
-        agent.role = agent_in.role    
+        values["role"] = agent_in.role    
+
+    if values:
+        # UPDATE ... RETURNING : 0 ligne = agent inexistant, email en double
+        # = violation de l'index unique
+        try:
+            agent = db.execute(
+                update(AGENTS)
+                .where(AGENTS.c.id == agent_id)
+                .values(**values)
+                .returning(*AGENTS.c)
+            ).one_or_none()
+            db.commit()
+        except IntegrityError as e:
+            db.rollback()
+            if not _is_email_conflict(e):
+                raise
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email déjà utilisé par un autre agent",
+            )
+    else:
+        agent = db.execute(select(AGENTS).where(AGENTS.c.id == agent_id)).one_or_none()
 
-    db.commit()
-    db.refresh(agent)
+    if agent is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Agent non trouvé",
+        )
+
+    leaderboard_cache.clear()
+    agent_directory.delete(agent_id)
     return agent
 
 
@@ -174,4 +336,6 @@ def delete_agent(agent_id: int, db: Session = Depends(get_db)):
 
     db.delete(agent)
     db.commit()
+    leaderboard_cache.clear()
+    agent_directory.delete(agent_id)
     # 204: pas de contenu à renvoyer
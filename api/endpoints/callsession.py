@@ -1,13 +1,22 @@
 # api/endpoints/call_session.py
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from pydantic import BaseModel
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status, Query
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, TypeAdapter, create_model
+from sqlalchemy import func, insert, select, update
 from sqlalchemy.orm import Session
 
-from db.database import get_db
+from db.database import get_db, SessionLocal
+from db import archive, rollups
 import db.models as models
 from db.models import ClientType, FinalStatus
 from auth.security import get_current_agent, get_current_admin
+from services import events
+from services.cache import leaderboard_cache
+from services.idempotency import idempotency, payload_digest
+from api.endpoints.agents import AgentSummary, agent_summaries
 
 router = APIRouter(prefix="/call-sessions", tags=["call_sessions"])
 
@@ -31,11 +40,107 @@ class CallSessionRead(CallSessionBase):
     agent_id: int
     result: str | None = None
     final_status: FinalStatus | None = None
+    created_at: datetime | None = None
+    closed_at: datetime | None = None
 
     class Config:
         from_attributes = True  # ou orm_mode=True si Pydantic v1
 
 
+class CallSessionWithAgent(CallSessionRead):
+    agent: AgentSummary | None = None
+
+
+# --------- PROJECTION (?fields=) / EMBEDDING (?include=agent) ---------
+
+FIELDS_DESCRIPTION = (
+    "Comma-separated columns to return, e.g. id,agent_id,client_type,final_status. "
+    "Only these columns are selected; ai_query / result are skipped unless asked for."
+)
+INCLUDE_DESCRIPTION = "include=agent embeds the agent's id / email / number in each session"
+
+
+def _parse_include(include: Optional[str]) -> bool:
+    if not include:
+        return False
+    requested = {i.strip() for i in include.split(",") if i.strip()}
+    unknown = requested - {"agent"}
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"include inconnu: {', '.join(sorted(unknown))}",
+        )
+    return "agent" in requested
+
+
+def _parse_fields(fields: Optional[str]) -> Optional[tuple]:
+    if not fields:
+        return None
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(CallSessionRead.model_fields)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Champs inconnus: {', '.join(sorted(unknown))}",
+        )
+    requested.add("id")
+    # ordre stable = même clé de cache pour la même projection
+    return tuple(f for f in CallSessionRead.model_fields if f in requested)
+
+
+@lru_cache(maxsize=64)
+def _projection_adapter(fields: tuple, include_agent: bool = False) -> TypeAdapter:
+    columns = {
+        name: (CallSessionRead.model_fields[name].annotation, ...)
+        for name in fields
+    }
+    if include_agent:
+        columns["agent"] = (Optional[AgentSummary], None)
+    model = create_model("CallSessionProjection", **columns)
+    return TypeAdapter(List[model])
+
+
+def _attach_agents(db: Session, items: List[dict]) -> None:
+    # une seule requête IN pour tous les agents absents de l'annuaire
+    summaries = agent_summaries(db, {item["agent_id"] for item in items})
+    for item in items:
+        item["agent"] = summaries.get(item["agent_id"])
+
+
+def _list_response(db: Session, query, fields: Optional[tuple], include_agent: bool = False):
+    """
+    Full ORM rows by default; otherwise a column-only SELECT (all columns
+    when only include=agent is set) serialized with a matching schema.
+    """
+    if fields is None and not include_agent:
+        return query.all()
+    if fields is None:
+        fields = tuple(CallSessionRead.model_fields)
+    elif include_agent and "agent_id" not in fields:
+        fields = fields + ("agent_id",)
+
+    rows = query.with_entities(
+        *[getattr(models.CallSession, name) for name in fields]
+    ).all()
+    items = [dict(row._mapping) for row in rows]
+    if include_agent:
+        _attach_agents(db, items)
+
+    adapter = _projection_adapter(fields, include_agent)
+    return Response(
+        content=adapter.dump_json(adapter.validate_python(items)),
+        media_type="application/json",
+    )
+
+
+CALL_SESSIONS = models.CallSession.__table__
+
+IDEMPOTENCY_DESCRIPTION = (
+    "Optional client-generated key: a retry with the same key and payload "
+    "returns the first response instead of writing again"
+)
+
+
 # --------- ROUTES ---------
 
 
@@ -48,20 +153,63 @@ class CallSessionRead(CallSessionBase):
 def create_call_session(
     session_in: CallSessionCreate,
     db: Session = Depends(get_db),
-    current_agent: models.Agent = Depends(get_current_agent)
+    current_agent: models.Agent = Depends(get_current_agent),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", description=IDEMPOTENCY_DESCRIPTION),
 ):
-    call_session = models.CallSession(
-        agent_id=current_agent.id,
-        client_type=session_in.client_type,
-        reason=session_in.reason,
-        ai_query=session_in.ai_query,
-        result=session_in.result,
-        final_status=session_in.final_status,
+    if idempotency_key is None:
+        call_session = _create_call_session(db, session_in, current_agent)
+        db.commit()
+        _notify("created", call_session)
+        return call_session
+
+    written = []
+
+    def write():
+        # pas de commit ici : idempotency.execute commit l'écriture et la clé ensemble
+        call_session = _create_call_session(db, session_in, current_agent)
+        written.append(call_session)
+        return CallSessionRead.model_validate(call_session).model_dump_json()
+
+    response = idempotency.execute(
+        db,
+        key=f"{current_agent.id}:POST /call-sessions/:{idempotency_key}",
+        digest=payload_digest(session_in.model_dump(mode="json")),
+        fn=write,
+        status_code=status.HTTP_201_CREATED,
     )
+    for call_session in written:  # vide si la réponse est rejouée
+        _notify("created", call_session)
+    return response
 
-    db.add(call_session)
-    db.commit()
-    db.refresh(call_session)
+
+def _notify(kind: str, call_session) -> None:
+    # après le commit uniquement
+    events.broker.publish(
+        events.TOPIC_CALL_SESSIONS, kind, events.call_session_event(call_session)
+    )
+    leaderboard_cache.clear()
+
+
+def _create_call_session(db: Session, session_in: CallSessionCreate, current_agent: models.Agent):
+    """INSERT + rollups; does not commit."""
+    now = models.utcnow()
+    # INSERT ... RETURNING : pas de refresh
+    call_session = db.execute(
+        insert(CALL_SESSIONS)
+        .values(
+            agent_id=current_agent.id,
+            client_type=session_in.client_type,
+            reason=session_in.reason,
+            ai_query=session_in.ai_query,
+            result=session_in.result,
+            final_status=session_in.final_status,
+            created_at=now,
+            closed_at=now if session_in.final_status is not None else None,
+        )
+        .returning(*CALL_SESSIONS.c)
+    ).one()
+
+    rollups.record_created(db, call_session)
     return call_session
 
 
@@ -79,6 +227,8 @@ def search_call_sessions(
     # Pagination partt 
     skip: int = Query(0, ge=0, description="Number of records to skip"), #for the pagination 
     limit: int = Query(100, ge=1, le=500, description="Maximum number of records to return"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    include: Optional[str] = Query(None, description=INCLUDE_DESCRIPTION),
     
     # Dependencies
     db: Session = Depends(get_db),
@@ -111,9 +261,9 @@ def search_call_sessions(
     
     query = query.order_by(models.CallSession.id.desc())
     
-    sessions = query.offset(skip).limit(limit).all()
-    
-    return sessions
+    return _list_response(
+        db, query.offset(skip).limit(limit), _parse_fields(fields), _parse_include(include)
+    )
 
 
 # Get only MY sessions (current agent)
@@ -124,6 +274,8 @@ def get_my_call_sessions(
     reason: Optional[str] = Query(None, description="Search in reason"),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=500),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    include: Optional[str] = Query(None, description=INCLUDE_DESCRIPTION),
     
     db: Session = Depends(get_db),
     current_agent: models.Agent = Depends(get_current_agent),
@@ -143,43 +295,89 @@ def get_my_call_sessions(
         query = query.filter(models.CallSession.reason.ilike(f"%{reason}%"))
     
     query = query.order_by(models.CallSession.id.desc())
-    sessions = query.offset(skip).limit(limit).all()
     
-    return sessions
+    return _list_response(
+        db, query.offset(skip).limit(limit), _parse_fields(fields), _parse_include(include)
+    )
 
 
 # LIST : tout agent peut voir TOUTES les sessions
 @router.get("/all", response_model=List[CallSessionRead])
 def list_all_call_sessions(
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    include: Optional[str] = Query(None, description=INCLUDE_DESCRIPTION),
     db: Session = Depends(get_db),
     current_agent: models.Agent = Depends(get_current_agent),
 ):
-    sessions = (
-        db.query(models.CallSession)
-        .order_by(models.CallSession.id.desc())
-        .all()
-    )
-    return sessions
+    query = db.query(models.CallSession).order_by(models.CallSession.id.desc())
+    return _list_response(db, query, _parse_fields(fields), _parse_include(include))
 
 
 # GET by id : retourner n'importe quelle session
 @router.get("/session/{session_id}", response_model=CallSessionRead)
 def get_call_session(
     session_id: int,
+    include: Optional[str] = Query(None, description=INCLUDE_DESCRIPTION),
     db: Session = Depends(get_db),
     current_agent: models.Agent = Depends(get_current_agent),
 ):
+    include_agent = _parse_include(include)
     session_obj = db.query(models.CallSession).filter(
         models.CallSession.id == session_id,
     ).first()
 
     if not session_obj:
+        # sessions anciennes : déplacées dans l'archive froide
+        session_obj = archive.get(session_id)
+        if session_obj is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Session non trouvée",
+            )
+
+    if not include_agent:
+        return session_obj
+
+    item = CallSessionRead.model_validate(session_obj).model_dump()
+    _attach_agents(db, [item])
+    return Response(
+        content=CallSessionWithAgent.model_validate(item).model_dump_json(),
+        media_type="application/json",
+    )
+
+
+# EXPORT : toutes les sessions (archive puis table chaude) en NDJSON streamé
+# Pas de Depends(get_current_agent) : FastAPI garde get_db ouvert jusqu'à la
+# fin de la réponse, soit une connexion du pool en plus pendant tout le flux.
+# L'agent est déjà vérifié par le middleware JWT.
+@router.get("/export")
+def export_call_sessions(request: Request):
+    if getattr(request.state, "current_agent", None) is None:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Session non trouvée",
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
         )
 
-    return session_obj
+    def rows():
+        # même sérialisation que la table chaude (dates, enums)
+        for row in archive.iter_rows():
+            yield CallSessionRead.model_validate(row).model_dump_json() + "\n"
+
+        # seule connexion utilisée par l'export, ouverte le temps du flux
+        db = SessionLocal()
+        try:
+            query = (
+                db.query(models.CallSession)
+                .order_by(models.CallSession.id)
+                .yield_per(1000)
+            )
+            for session_obj in query:
+                yield CallSessionRead.model_validate(session_obj).model_dump_json() + "\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
 
 
 @router.put("/update/{session_id}", response_model=CallSessionRead)
@@ -188,28 +386,78 @@ def update_call_session(
     session_in: CallSessionCreate,
     db: Session = Depends(get_db),
     current_agent: models.Agent = Depends(get_current_agent),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", description=IDEMPOTENCY_DESCRIPTION),
 ):
-    session_obj = db.query(models.CallSession).filter(
-        models.CallSession.id == session_id,
-    ).first()
+    if idempotency_key is None:
+        session_obj = _update_call_session(db, session_id, session_in)
+        db.commit()
+        _notify("updated", session_obj)
+        return session_obj
+
+    written = []
+
+    def write():
+        session_obj = _update_call_session(db, session_id, session_in)
+        written.append(session_obj)
+        return CallSessionRead.model_validate(session_obj).model_dump_json()
+
+    response = idempotency.execute(
+        db,
+        key=f"{current_agent.id}:PUT /call-sessions/update/{session_id}:{idempotency_key}",
+        digest=payload_digest(session_in.model_dump(mode="json")),
+        fn=write,
+    )
+    for session_obj in written:
+        _notify("updated", session_obj)
+    return response
 
-    if not session_obj:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Session non trouvée",
-        )
 
+def _update_call_session(db: Session, session_id: int, session_in: CallSessionCreate):
+    """UPDATE + rollups; does not commit."""
     # Mettre à jour les champs
-    session_obj.client_type = session_in.client_type
-    session_obj.reason = session_in.reason
-    session_obj.ai_query = session_in.ai_query
+    values = {
+        "client_type": session_in.client_type,
+        "reason": session_in.reason,
+        "ai_query": session_in.ai_query,
+    }
     if session_in.result is not None:
-        session_obj.result = session_in.result
+        values["result"] = session_in.result
     if session_in.final_status is not None:
-        session_obj.final_status = session_in.final_status
+        values["final_status"] = session_in.final_status
+        values["closed_at"] = func.coalesce(CALL_SESSIONS.c.closed_at, models.utcnow())
+
+    # UPDATE ... RETURNING en une requête ; la CTE verrouille la ligne et
+    # renvoie l'ancien type / statut dont les rollups ont besoin
+    old = (
+        select(CALL_SESSIONS.c.id, CALL_SESSIONS.c.client_type, CALL_SESSIONS.c.final_status)
+        .where(CALL_SESSIONS.c.id == session_id)
+        .with_for_update()
+        .cte("old")
+    )
+    session_obj = db.execute(
+        update(CALL_SESSIONS)
+        .where(CALL_SESSIONS.c.id == old.c.id)
+        .values(**values)
+        .returning(
+            *CALL_SESSIONS.c,
+            old.c.client_type.label("old_client_type"),
+            old.c.final_status.label("old_final_status"),
+        )
+    ).one_or_none()
 
-    db.commit()
-    db.refresh(session_obj)
+    if session_obj is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session non trouvée",
+        )
+
+    old_key = rollups.make_key(
+        session_obj.created_at,
+        session_obj.agent_id,
+        session_obj.old_client_type,
+        session_obj.old_final_status,
+    )
+    rollups.record_updated(db, old_key, session_obj)
     return session_obj
 
 
@@ -229,12 +477,20 @@ def delete_call_session(
             detail="Session non trouvée",
         )
 
+    payload = events.call_session_event(session_obj)
+    rollups.record_deleted(db, session_obj)
     db.delete(session_obj)
     db.commit()
+    events.broker.publish(events.TOPIC_CALL_SESSIONS, "deleted", payload)
+    leaderboard_cache.clear()
 
 
 # Get statistics
-@router.get("/stats")
+@router.get(
+    "/stats",
+    description="Counts over the live table only: archived sessions (see /archive) "
+    "are not included. /stats/timeseries covers archived sessions too.",
+)
 def get_call_session_stats(
     db: Session = Depends(get_db),
     current_agent: models.Agent = Depends(get_current_agent),
@@ -269,3 +525,106 @@ def get_call_session_stats(
         "by_final_status": {str(status): count for status, count in by_status},
         "by_agent": {agent_id: count for agent_id, count in by_agent}
     }
+
+
+# Time-bucketed statistics (lit uniquement call_session_rollups)
+MAX_TIMESERIES_POINTS = 5000
+BUCKET_SIZES = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+
+@router.get("/stats/timeseries")
+def get_call_session_timeseries(
+    from_: Optional[datetime] = Query(
+        None,
+        alias="from",
+        description="Start (inclusive), default: to - 24h. Rounded down to the start of its "
+        "bucket (e.g. from=10:30&bucket=day covers the whole day); the response's "
+        "'from' is the effective start",
+    ),
+    to: Optional[datetime] = Query(None, description="End (exclusive), default: now"),
+    bucket: Literal["minute", "hour", "day"] = Query("hour", description="Bucket size"),
+    agent_id: Optional[int] = Query(None, description="Filter by agent ID"),
+    db: Session = Depends(get_db),
+    current_agent: models.Agent = Depends(get_current_agent),
+):
+    # dates naïves = UTC
+    if to is None:
+        to = datetime.now(timezone.utc)
+    elif to.tzinfo is None:
+        to = to.replace(tzinfo=timezone.utc)
+    if from_ is None:
+        from_ = to - timedelta(hours=24)
+    elif from_.tzinfo is None:
+        from_ = from_.replace(tzinfo=timezone.utc)
+
+    if from_ >= to:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'from' doit être antérieur à 'to'",
+        )
+    # bucket entamé = bucket entier : on annonce le début effectif
+    from_ = rollups.bucket_start(from_, bucket)
+
+    if bucket == "minute" and from_ < rollups.minute_cutoff():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"bucket=minute limité aux {rollups.MINUTE_RETENTION_DAYS} derniers jours "
+            "(utiliser hour ou day)",
+        )
+    if (to - from_) / BUCKET_SIZES[bucket] > MAX_TIMESERIES_POINTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Intervalle trop large pour bucket={bucket} (max {MAX_TIMESERIES_POINTS} points)",
+        )
+
+    return {
+        "from": from_,
+        "to": to,
+        "bucket": bucket,
+        "agent_id": agent_id,
+        "points": rollups.timeseries(db, from_, to, bucket, agent_id=agent_id),
+    }
+
+
+# Recalcul des rollups depuis call_sessions (backfill / réparation)
+@router.post("/stats/rollups/rebuild")
+def rebuild_call_session_rollups(
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = Query(None),
+    db: Session = Depends(get_db),
+    current_agent: models.Agent = Depends(get_current_admin),
+):
+    # fenêtre alignée sur des jours entiers pour ne pas tronquer un bucket
+    if from_ is not None:
+        from_ = rollups.bucket_start(from_, "day")
+    if to is not None:
+        to = rollups.bucket_start(to, "day") + timedelta(days=1)
+    inserted = rollups.rebuild(db, from_, to)
+    db.commit()
+    return {"rows": inserted, "from": from_, "to": to}
+
+
+# ARCHIVE : déplace les sessions anciennes vers les segments froids
+@router.post(
+    "/archive",
+    description="Moves old sessions to cold segments. Archived sessions stay readable "
+    "via /session/{id} and /export, but no longer count in /stats or /agents/leaderboard.",
+)
+def archive_call_sessions(
+    older_than_days: int = Query(archive.ARCHIVE_AFTER_DAYS, ge=1, description="Archive sessions older than N days"),
+    db: Session = Depends(get_db),
+    current_agent: models.Agent = Depends(get_current_admin),
+):
+    try:
+        result = archive.archive_older_than(db, older_than_days)
+    except archive.ArchiveBusy:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Archivage déjà en cours",
+        )
+    leaderboard_cache.clear()
+    return {**result, **archive.stats()}
@@ -0,0 +1,144 @@
+# api/endpoints/events.py
+import asyncio
+import json
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+
+from db.database import SessionLocal
+import db.models as models
+from db.models import ClientType, FinalStatus
+from auth.security import get_current_agent, verify_token
+from services.events import broker, DROPPED, TOPIC_CALL_SESSIONS, TOPIC_KB
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+# intervalle des keep-alive SSE (les proxies coupent les flux muets)
+KEEPALIVE_SECONDS = 15
+
+
+def _topics(topics: Optional[List[str]]) -> Optional[set]:
+    if not topics:
+        return None
+    return {t for t in topics if t in (TOPIC_CALL_SESSIONS, TOPIC_KB)} or None
+
+
+# SSE : authentifié par le middleware JWT (header Authorization).
+# Pas de Depends(get_current_agent) : get_db resterait ouvert (une connexion
+# du pool) tant que le client est connecté
+@router.get("/stream")
+async def stream_events(
+    request: Request,
+    topic: Optional[List[str]] = Query(None, description="call_sessions and/or kb"),
+    agent_id: Optional[int] = Query(None, description="Filter by agent ID"),
+    client_type: Optional[ClientType] = Query(None, description="Filter by client type"),
+    final_status: Optional[FinalStatus] = Query(None, description="Filter by final status"),
+):
+    # vérifié par le middleware JWT
+    if getattr(request.state, "current_agent", None) is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    sub = broker.subscribe(
+        topics=_topics(topic),
+        agent_id=agent_id,
+        client_type=client_type,
+        final_status=final_status,
+    )
+
+    async def event_source():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is DROPPED:
+                    yield "event: dropped\ndata: {}\n\n"
+                    return
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(sub)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# WebSocket : le middleware HTTP ne voit pas les websockets,
+# le token est passé en query (?token=) ou dans le header Authorization
+@router.websocket("/ws")
+async def websocket_events(
+    websocket: WebSocket,
+    token: Optional[str] = Query(None),
+    topic: Optional[List[str]] = Query(None),
+    agent_id: Optional[int] = Query(None),
+    client_type: Optional[ClientType] = Query(None),
+    final_status: Optional[FinalStatus] = Query(None),
+):
+    if token is None:
+        auth_header = websocket.headers.get("Authorization", "")
+        scheme, _, value = auth_header.partition(" ")
+        if scheme.lower() == "bearer":
+            token = value
+
+    if not token:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    db = SessionLocal()
+    try:
+        await asyncio.to_thread(verify_token, token, db)
+    except Exception:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    finally:
+        db.close()
+
+    await websocket.accept()
+    sub = broker.subscribe(
+        topics=_topics(topic),
+        agent_id=agent_id,
+        client_type=client_type,
+        final_status=final_status,
+    )
+
+    async def watch_disconnect():
+        # on ignore les messages du client, on attend juste la déconnexion
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        while True:
+            getter = asyncio.create_task(sub.get())
+            done, _ = await asyncio.wait(
+                {getter, watcher}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if watcher in done:
+                getter.cancel()
+                return
+            event = getter.result()
+            if event is DROPPED:
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                return
+            await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        watcher.cancel()
+        broker.unsubscribe(sub)
+
+
+@router.get("/stats")
+def events_stats(current_agent: models.Agent = Depends(get_current_agent)):
+    return broker.stats()
@@ -0,0 +1,60 @@
+# api/endpoints/health.py
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+
+from db.database import engine
+from services.warmup import state
+
+# public (pas de JWT) : utilisé par le load balancer
+router = APIRouter(tags=["health"])
+
+
+def _pool_status() -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": getattr(pool, "_max_overflow", 0),
+    }
+
+
+# LIVENESS : le processus répond
+@router.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+# READINESS : warm-up terminé, pas en arrêt, pool et DB disponibles
+@router.get("/readyz")
+def readyz():
+    pool = _pool_status()
+    body = {
+        "ready": False,
+        "warmed_up": state.ready,
+        "warmup_seconds": state.warmup_seconds,
+        "draining": state.draining,
+        "pool": pool,
+        "db": None,
+    }
+
+    if state.draining or not state.ready:
+        body["error"] = state.last_error
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=body)
+
+    # pool saturé : un SELECT 1 attendrait pool_timeout, inutile d'essayer
+    if pool["checked_out"] >= pool["size"] + pool["max_overflow"]:
+        body["db"] = "pool exhausted"
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=body)
+
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        body["db"] = f"error: {e}"
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=body)
+
+    body["db"] = "ok"
+    body["ready"] = True
+    return body
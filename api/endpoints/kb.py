@@ -1,17 +1,25 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query, Response, status
 from pathlib import Path
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+from sqlalchemy import insert, or_, select, update
 from sqlalchemy.orm import Session
 from fastapi import Depends
 from db.database import get_db
+from db import kb_categories
 import db.models as models
 from auth.security import get_current_agent
+from services import events
+from services.kb_dedup import (
+    DUPLICATE_MODE, DUPLICATE_THRESHOLD, MIN_THRESHOLD, entry_signature, kb_index,
+)
 
 # Require a valid JWT for every /kb route; handlers can accept
 # `current_agent: models.Agent = Depends(get_current_agent)` to access it.
 router = APIRouter(prefix="/kb", tags=["kb"], dependencies=[Depends(get_current_agent)])
 
+KB_ENTRIES = models.kbase_entry.__table__
+
 
 class kbentry_payload(BaseModel):
     question: str
@@ -20,56 +28,182 @@ class kbentry_payload(BaseModel):
     category: Optional[str] = None
 
 
+def _signature(payload: kbentry_payload):
+    # None quand la détection est désactivée : rien à calculer ni à stocker
+    if DUPLICATE_MODE == "off":
+        return None
+    return entry_signature(payload.question, payload.answer)
+
+
+def _near_duplicates(db: Session, sig, exclude_id: Optional[int] = None) -> List[dict]:
+    """Near-duplicates of signature `sig`; raises 409 when KB_DUPLICATE_MODE=reject."""
+    if sig is None:
+        return []
+    duplicates = [
+        {"id": entry_id, "similarity": round(score, 3)}
+        for entry_id, score in kb_index.find_similar(db, sig, exclude_id=exclude_id)
+    ]
+    if duplicates and DUPLICATE_MODE == "reject":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Entrée quasi identique déjà présente.", "near_duplicates": duplicates},
+        )
+    return duplicates
+
+
 @router.post("/add", status_code=201)
 def create_kb_entry(
     payload: kbentry_payload,
     db: Session = Depends(get_db),
     current_agent: models.Agent = Depends(get_current_agent),
 ):
-    kb_entry = models.kbase_entry(
-        question=payload.question,
-        answer=payload.answer,
-        category=payload.category,
-    )
-    db.add(kb_entry)
+    sig = _signature(payload)
+    duplicates = _near_duplicates(db, sig)
+    # INSERT ... RETURNING : pas de refresh après le commit
+    kb_entry = db.execute(
+        insert(KB_ENTRIES)
+        .values(
+            question=payload.question,
+            answer=payload.answer,
+            category=payload.category or None,  # "" = non catégorisée
+        )
+        .returning(*KB_ENTRIES.c)
+    ).one()
+    kb_categories.record(db, new_category=kb_entry.category, created=True)
+    if sig is not None:
+        kb_index.store(db, [(kb_entry.id, sig)])
     db.commit()
-    db.refresh(kb_entry)
+    events.broker.publish(events.TOPIC_KB, "created", events.kb_event(kb_entry))
     return {
         "id": kb_entry.id,
         "question": kb_entry.question,
         "answer": kb_entry.answer,
         "category": kb_entry.category,
+        "near_duplicates": duplicates,
         "message": "Knowledge base entry created successfully.",
     }
 
 @router.get("/all", status_code=200)
-def list_kb(db: Session = Depends(get_db), current_agent: models.Agent = Depends(get_current_agent)): 
-    kb_entries = db.query(models.kbase_entry).all()
+def list_kb(
+    response: Response,
+    category: Optional[str] = Query(None, description="Only this category (empty = uncategorized)"),
+    after_id: Optional[int] = Query(None, ge=0, description="Keyset cursor: last id of the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size"),
+    db: Session = Depends(get_db),
+    current_agent: models.Agent = Depends(get_current_agent),
+): 
+    query = db.query(models.kbase_entry)
+    if category is not None:
+        if category == "":
+            # comme les facettes : NULL et "" (anciennes entrées) = non catégorisée
+            query = query.filter(
+                or_(models.kbase_entry.category.is_(None), models.kbase_entry.category == "")
+            )
+        else:
+            query = query.filter(models.kbase_entry.category == category)
+    if after_id is not None:
+        query = query.filter(models.kbase_entry.id > after_id)
+    if category is not None or after_id is not None or limit is not None:
+        # keyset : index (category, id), pas d'OFFSET
+        query = query.order_by(models.kbase_entry.id)
+    if limit is not None:
+        query = query.limit(limit)
+
+    kb_entries = query.all()
+    if limit is not None and len(kb_entries) == limit:
+        response.headers["X-Next-After-Id"] = str(kb_entries[-1].id)
     return kb_entries    
 
+
+# Facettes : nombre d'entrées par catégorie (compteurs maintenus à l'écriture)
+@router.get("/categories", status_code=200)
+def list_kb_categories(db: Session = Depends(get_db)):
+    return kb_categories.facets(db)
+
 @router.delete("/delete/{kb_id}", status_code=200)
 def delete_kb_entry(kb_id:int , db : Session = Depends(get_db)):
     kb_entry = db.query(models.kbase_entry).filter(models.kbase_entry.id == kb_id).first()
     if not kb_entry:
         return {"message": "Knowledge base entry not found."}
+    payload = events.kb_event(kb_entry)
+    kb_categories.record(db, old_category=kb_entry.category, deleted=True)
     db.delete(kb_entry)
+    # signature / bandes MinHash : ON DELETE CASCADE
     db.commit()
+    events.broker.publish(events.TOPIC_KB, "deleted", payload)
     return {"message": "Knowledge base entry deleted successfully."}
 
 @router.put("/update/{kb_id}", status_code=200)
 def update_kb_entry(kb_id:int, payload: kbentry_payload, db : Session = Depends(get_db)):
-    kb_entry = db.query(models.kbase_entry).filter(models.kbase_entry.id == kb_id).first()
-    if not kb_entry:
+    # existence d'abord (sans verrou) : une entrée absente répond "not found", pas 409
+    if db.execute(select(KB_ENTRIES.c.id).where(KB_ENTRIES.c.id == kb_id)).first() is None:
+        return {"message": "Knowledge base entry not found."}
+    # doublons avant l'UPDATE : aucun verrou de ligne tenu pendant la recherche
+    sig = _signature(payload)
+    duplicates = _near_duplicates(db, sig, exclude_id=kb_id)
+
+    # UPDATE ... RETURNING ; la CTE verrouille la ligne et donne l'ancienne
+    # catégorie pour les compteurs de facettes
+    old = (
+        select(KB_ENTRIES.c.id, KB_ENTRIES.c.category)
+        .where(KB_ENTRIES.c.id == kb_id)
+        .with_for_update()
+        .cte("old")
+    )
+    kb_entry = db.execute(
+        update(KB_ENTRIES)
+        .where(KB_ENTRIES.c.id == old.c.id)
+        .values(
+            question=payload.question,
+            answer=payload.answer,
+            category=payload.category or None,  # "" = non catégorisée
+        )
+        .returning(*KB_ENTRIES.c, old.c.category.label("old_category"))
+    ).one_or_none()
+    if kb_entry is None:
+        # supprimée entre-temps
         return {"message": "Knowledge base entry not found."}
-    kb_entry.question = payload.question
-    kb_entry.answer = payload.answer
-    kb_entry.category = payload.category
+    kb_categories.record(db, old_category=kb_entry.old_category, new_category=kb_entry.category)
+    if sig is not None:
+        kb_index.store(db, [(kb_entry.id, sig)])
     db.commit()
-    db.refresh(kb_entry)
+    events.broker.publish(events.TOPIC_KB, "updated", events.kb_event(kb_entry))
     return {
         "id": kb_entry.id,
         "question": kb_entry.question,
         "answer": kb_entry.answer,
         "category": kb_entry.category,
+        "near_duplicates": duplicates,
         "message": "Knowledge base entry updated successfully.",
+    }
+
+
+# Groupes d'entrées quasi identiques (MinHash / LSH, pas de comparaison O(n²))
+@router.get("/duplicates", status_code=200)
+def list_kb_duplicates(
+    threshold: float = Query(
+        DUPLICATE_THRESHOLD,
+        ge=MIN_THRESHOLD,
+        le=1.0,
+        description=f"Minimum estimated Jaccard similarity (>= {MIN_THRESHOLD}: below that, "
+        "the 16x8 LSH banding misses most pairs)",
+    ),
+    db: Session = Depends(get_db),
+):
+    clusters = kb_index.clusters(db, threshold)
+
+    ids = [entry_id for cluster in clusters for entry_id in cluster]
+    questions = {}
+    if ids:
+        questions = dict(
+            db.query(models.kbase_entry.id, models.kbase_entry.question)
+            .filter(models.kbase_entry.id.in_(ids))
+            .all()
+        )
+    return {
+        "threshold": threshold,
+        "clusters": [
+            [{"id": entry_id, "question": questions.get(entry_id)} for entry_id in cluster]
+            for cluster in clusters
+        ],
     }
\ No newline at end of file
@@ -0,0 +1,27 @@
+# api/endpoints/metrics.py
+from fastapi import APIRouter, Depends
+
+import db.models as models
+from db import archive
+from auth.security import get_current_admin
+from services.cache import agent_directory, leaderboard_cache
+from services.events import broker
+from services.idempotency import idempotency
+from services.kb_dedup import kb_index
+from services.singleflight import singleflight
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+# compteurs internes du worker courant (chaque worker a les siens)
+@router.get("/")
+def get_metrics(current_agent: models.Agent = Depends(get_current_admin)):
+    return {
+        "singleflight": singleflight.stats(),
+        "leaderboard_cache": leaderboard_cache.stats(),
+        "agent_directory": agent_directory.stats(),
+        "events": broker.stats(),
+        "archive": archive.stats(),
+        "kb_index": kb_index.stats(),
+        "idempotency": idempotency.stats(),
+    }
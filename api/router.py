@@ -1,8 +1,11 @@
 from fastapi import APIRouter
-from api.endpoints import agents, auth, callsession, kb
+from api.endpoints import agents, auth, callsession, events, health, kb, metrics
 
 api_router = APIRouter()
 api_router.include_router(agents.router)
 api_router.include_router(auth.router)
 api_router.include_router(callsession.router)
-api_router.include_router(kb.router)
\ No newline at end of file
+api_router.include_router(kb.router)
+api_router.include_router(events.router)
+api_router.include_router(metrics.router)
+api_router.include_router(health.router)
\ No newline at end of file
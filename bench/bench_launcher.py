@@ -0,0 +1,75 @@
+# bench/bench_launcher.py
+"""
+Startup time and throughput: dev launcher (main.py) vs serve.py.
+
+    python -m bench.bench_launcher
+    DURATION=20 CONCURRENCY=64 python -m bench.bench_launcher
+
+Each launcher is started on its own port, timed until /openapi.json
+answers, loaded for DURATION seconds, then stopped with SIGTERM.
+"""
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+DURATION = float(os.getenv("DURATION", "10"))
+CONCURRENCY = int(os.getenv("CONCURRENCY", "32"))
+PATH = os.getenv("BENCH_PATH", "/openapi.json")  # public, no DB round trip
+
+LAUNCHERS = {
+    "main.py (reload, 1 process)": [
+        sys.executable, "-c",
+        "import uvicorn; uvicorn.run('main:app', host='127.0.0.1', port=7101, reload=True)",
+    ],
+    "serve.py": [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", "7102"],
+}
+PORTS = {"main.py (reload, 1 process)": 7101, "serve.py": 7102}
+
+
+def wait_until_up(url: str, timeout: float = 120.0) -> float:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"{url} not up after {timeout}s")
+
+
+async def load(url: str) -> int:
+    done = 0
+    deadline = time.perf_counter() + DURATION
+    limits = httpx.Limits(max_connections=CONCURRENCY)
+    async with httpx.AsyncClient(limits=limits, timeout=10) as client:
+        async def worker():
+            nonlocal done
+            while time.perf_counter() < deadline:
+                r = await client.get(url)
+                if r.status_code == 200:
+                    done += 1
+        await asyncio.gather(*[worker() for _ in range(CONCURRENCY)])
+    return done
+
+
+def main() -> None:
+    for name, cmd in LAUNCHERS.items():
+        url = f"http://127.0.0.1:{PORTS[name]}{PATH}"
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            startup = wait_until_up(url)
+            requests = asyncio.run(load(url))
+            print(f"{name:<30} startup {startup:6.2f}s  {requests / DURATION:8.1f} req/s")
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(timeout=60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# bench/bench_projection.py
+"""
+Bytes on the wire and DB payload for a 500-row session page,
+with and without ?fields= projection and gzip.
+
+    BASE_URL=http://localhost:7000 TOKEN=<jwt> python -m bench.bench_projection
+"""
+import os
+import time
+
+import httpx
+
+from db.database import SessionLocal
+import db.models as models
+
+BASE_URL = os.getenv("BASE_URL", "http://localhost:7000")
+TOKEN = os.getenv("TOKEN", "")
+PAGE = 500
+LIST_FIELDS = "id,agent_id,client_type,final_status"
+RUNS = 5
+
+
+def db_side():
+    db = SessionLocal()
+    try:
+        for label, columns in (
+            ("full rows", list(models.CallSession.__table__.c)),
+            ("projection", [getattr(models.CallSession, f) for f in LIST_FIELDS.split(",")]),
+        ):
+            best = None
+            for _ in range(RUNS):
+                start = time.perf_counter()
+                rows = (
+                    db.query(*columns)
+                    .order_by(models.CallSession.id.desc())
+                    .limit(PAGE)
+                    .all()
+                )
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            payload = sum(len(str(v)) for row in rows for v in row if v is not None)
+            print(f"DB   {label:<12} rows={len(rows):<4} ~{payload:>9} bytes  best {best * 1000:.1f} ms")
+    finally:
+        db.close()
+
+
+def http_side():
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    with httpx.Client(base_url=BASE_URL, headers=headers, timeout=30) as client:
+        for label, params in (
+            ("full rows", {"limit": PAGE}),
+            ("projection", {"limit": PAGE, "fields": LIST_FIELDS}),
+        ):
+            for encoding in ("identity", "gzip"):
+                r = client.get(
+                    "/call-sessions/search",
+                    params=params,
+                    headers={"Accept-Encoding": encoding},
+                )
+                r.raise_for_status()
+                # content-length = taille compressée (httpx décompresse r.content)
+                wire = int(r.headers.get("content-length", len(r.content)))
+                print(f"HTTP {label:<12} {encoding:<8} {wire:>9} bytes on the wire")
+
+
+if __name__ == "__main__":
+    db_side()
+    if TOKEN:
+        http_side()
+    else:
+        print("HTTP skipped: set TOKEN to a valid JWT")
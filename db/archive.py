@@ -0,0 +1,219 @@
+# db/archive.py
+"""
+Hot/cold archival of call sessions.
+
+Sessions older than ARCHIVE_AFTER_DAYS are moved out of `call_sessions`
+into append-only segment files on local disk:
+
+    <ARCHIVE_DIR>/seg-<min_id>-<max_id>.json.gz   columnar, gzip-compressed
+    <ARCHIVE_DIR>/index.json                      [{file, min_id, max_id, rows}]
+
+A segment stores one list per column, rows sorted by id, so a lookup is an
+index scan on min/max id followed by a bisect in the `id` column. Segments
+are never rewritten; every archival run only adds new ones.
+
+Rollups (db/rollups.py) are left untouched, and `rollups.rebuild()` reads
+the segments too, so time-series stats still include archived sessions. /call-sessions/stats and /agents/leaderboard
+read the live table and only count sessions that are not archived.
+"""
+import bisect
+import gzip
+import json
+import os
+import threading
+from datetime import timedelta
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.orm import Session
+
+import db.models as models
+
+ARCHIVE_DIR = os.getenv("CALL_SESSION_ARCHIVE_DIR", "archive/call_sessions")
+ARCHIVE_AFTER_DAYS = int(os.getenv("CALL_SESSION_ARCHIVE_AFTER_DAYS", "90"))
+SEGMENT_ROWS = 10_000
+
+COLUMNS = (
+    "id",
+    "agent_id",
+    "client_type",
+    "reason",
+    "ai_query",
+    "result",
+    "final_status",
+    "created_at",
+    "closed_at",
+)
+
+# clé d'advisory lock Postgres : un seul archivage à la fois, tous workers
+_ADVISORY_LOCK_KEY = 730_030
+
+_index_lock = threading.Lock()
+
+
+class ArchiveBusy(Exception):
+    pass
+
+
+def _encode(value):
+    value = getattr(value, "value", value)  # Enum
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def _index_path() -> str:
+    return os.path.join(ARCHIVE_DIR, "index.json")
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# ---------- index ----------
+
+@lru_cache(maxsize=4)
+def _load_index(mtime: float) -> List[Dict[str, Any]]:
+    with open(_index_path(), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_index() -> List[Dict[str, Any]]:
+    try:
+        mtime = os.path.getmtime(_index_path())
+    except FileNotFoundError:
+        return []
+    return _load_index(mtime)
+
+
+# ---------- segments ----------
+
+@lru_cache(maxsize=8)
+def _load_segment(filename: str) -> Dict[str, list]:
+    with gzip.open(os.path.join(ARCHIVE_DIR, filename), "rt", encoding="utf-8") as f:
+        return json.load(f)["columns"]
+
+
+def _write_segment(rows) -> Dict[str, Any]:
+    columns = {name: [_encode(getattr(row, name)) for row in rows] for name in COLUMNS}
+    min_id, max_id = columns["id"][0], columns["id"][-1]
+    filename = f"seg-{min_id:012d}-{max_id:012d}.json.gz"
+    payload = json.dumps({"version": 1, "columns": columns}, separators=(",", ":"))
+    _write_atomic(
+        os.path.join(ARCHIVE_DIR, filename),
+        gzip.compress(payload.encode("utf-8"), compresslevel=9),
+    )
+    return {"file": filename, "min_id": min_id, "max_id": max_id, "rows": len(rows)}
+
+
+def _append_index(entry: Dict[str, Any]) -> None:
+    with _index_lock:
+        index = [e for e in read_index() if e["file"] != entry["file"]]
+        index.append(entry)
+        index.sort(key=lambda e: e["min_id"])
+        _write_atomic(_index_path(), json.dumps(index, indent=1).encode("utf-8"))
+
+
+def _row(columns: Dict[str, list], i: int) -> Dict[str, Any]:
+    return {name: columns[name][i] for name in COLUMNS}
+
+
+# ---------- lecture ----------
+
+def get(session_id: int) -> Optional[Dict[str, Any]]:
+    """Look up one archived session, or None."""
+    for entry in read_index():
+        if entry["min_id"] > session_id:
+            break
+        if entry["max_id"] < session_id:
+            continue
+        columns = _load_segment(entry["file"])
+        ids = columns["id"]
+        i = bisect.bisect_left(ids, session_id)
+        if i < len(ids) and ids[i] == session_id:
+            return _row(columns, i)
+    return None
+
+
+def iter_segments() -> Iterator[Tuple[Dict[str, Any], Dict[str, list]]]:
+    """(index entry, columns) for every segment, by ascending id."""
+    for entry in read_index():
+        # pas de lru ici : un parcours complet viderait le cache des lookups
+        with gzip.open(os.path.join(ARCHIVE_DIR, entry["file"]), "rt", encoding="utf-8") as f:
+            yield entry, json.load(f)["columns"]
+
+
+def iter_rows() -> Iterator[Dict[str, Any]]:
+    """All archived sessions, segment by segment, by ascending id."""
+    for _, columns in iter_segments():
+        for i in range(len(columns["id"])):
+            yield _row(columns, i)
+
+
+def stats() -> Dict[str, int]:
+    index = read_index()
+    return {"segments": len(index), "rows": sum(e["rows"] for e in index)}
+
+
+# ---------- archivage ----------
+
+def archive_older_than(db: Session, days: int = ARCHIVE_AFTER_DAYS) -> Dict[str, int]:
+    """
+    Move sessions created more than `days` ago into new segments.
+    Each batch is a DELETE ... RETURNING: the segment is built from the
+    deleted rows themselves (an update committed meanwhile is either in
+    them or waited for), and the transaction is committed only once the
+    segment and the index are durably on disk.
+    """
+    CS = models.CallSession.__table__
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    cutoff = models.utcnow() - timedelta(days=days)
+
+    archived = segments = 0
+    while True:
+        # verrou de transaction : relâché au commit / rollback de chaque lot
+        locked = db.execute(
+            text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": _ADVISORY_LOCK_KEY}
+        ).scalar()
+        if not locked:
+            db.rollback()
+            if archived:
+                break
+            raise ArchiveBusy()
+
+        batch = (
+            select(CS.c.id)
+            .where(CS.c.created_at < cutoff)
+            .order_by(CS.c.id)
+            .limit(SEGMENT_ROWS)
+            .scalar_subquery()
+        )
+        rows = db.execute(
+            delete(CS).where(CS.c.id.in_(batch)).returning(*CS.c)
+        ).all()
+        if not rows:
+            db.rollback()
+            break
+        # RETURNING ne garantit pas l'ordre
+        rows.sort(key=lambda row: row.id)
+
+        try:
+            entry = _write_segment(rows)
+            _append_index(entry)
+        except Exception:
+            db.rollback()
+            raise
+        # si ce commit échoue, les lignes restent aussi en base : les
+        # lectures passent par la table chaude d'abord, le doublon est inoffensif
+        db.commit()
+
+        archived += len(rows)
+        segments += 1
+
+    return {"archived": archived, "segments": segments}
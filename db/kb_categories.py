@@ -0,0 +1,72 @@
+# db/kb_categories.py
+"""
+KB category facets.
+
+`kb_category_counts` holds one row per category with its number of
+entries. KB writes adjust it in their own transaction, so /kb/categories
+is a primary-key table scan instead of a GROUP BY over kbase_entries.
+Uncategorized entries are counted under "".
+"""
+from collections import defaultdict
+from typing import List, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+import db.models as models
+
+Counts = models.KbCategoryCount
+
+
+def _key(category: Optional[str]) -> str:
+    return category or ""
+
+
+def record(db: Session, old_category: Optional[str] = None, new_category: Optional[str] = None,
+           created: bool = False, deleted: bool = False) -> None:
+    """
+    Adjust facet counts for one KB write. Does not commit.
+        created: +1 new_category
+        deleted: -1 old_category
+        update : -1 old_category, +1 new_category (no-op if unchanged)
+    """
+    deltas = defaultdict(int)
+    if created or not deleted:
+        deltas[_key(new_category)] += 1
+    if deleted or not created:
+        deltas[_key(old_category)] -= 1
+
+    rows = [{"category": c, "count": d} for c, d in deltas.items() if d]
+    if not rows:
+        return
+    stmt = pg_insert(Counts).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Counts.category],
+        set_={"count": Counts.count + stmt.excluded.count},
+    )
+    db.execute(stmt)
+
+
+def rebuild(db: Session) -> int:
+    """Recompute every count from kbase_entries. Does not commit."""
+    db.execute(delete(Counts))
+    category = func.coalesce(models.kbase_entry.category, "")
+    rows = [
+        {"category": c, "count": n}
+        for c, n in db.execute(
+            select(category, func.count(models.kbase_entry.id)).group_by(category)
+        )
+    ]
+    if rows:
+        db.execute(pg_insert(Counts).values(rows))
+    return len(rows)
+
+
+def facets(db: Session) -> List[dict]:
+    rows = db.execute(
+        select(Counts.category, Counts.count)
+        .where(Counts.count > 0)
+        .order_by(Counts.count.desc(), Counts.category)
+    )
+    return [{"category": c or None, "count": n} for c, n in rows]
@@ -0,0 +1,103 @@
+# db/migrations.py
+"""
+Idempotent schema upgrades for tables that already exist in the remote DB.
+
+`Base.metadata.create_all()` only creates missing tables, it never adds
+columns or indexes to existing ones (that's how `role` went missing, see
+add.py). Every statement here must be safe to run on each startup.
+
+`upgrade()` runs from the entry points (serve.py, `python main.py`), once
+per deploy, not at import: workers and their --max-requests restarts never
+run it. It is still serialized by a Postgres advisory lock in case two
+launchers start together. ALTERs are skipped when the column already
+exists (ALTER TABLE takes an ACCESS EXCLUSIVE lock even as a no-op) and
+indexes are built CONCURRENTLY, so a deploy doesn't block writes.
+"""
+import logging
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+import db.models as models
+from db import kb_categories, rollups
+
+logger = logging.getLogger("doxa.migrations")
+
+# clé d'advisory lock Postgres : une seule migration à la fois, tous processus
+_ADVISORY_LOCK_KEY = 730_027
+
+# (table, colonne, type) : ALTER TABLE ... ADD COLUMN seulement si absente
+COLUMNS = [
+    # user-027 : horodatage des sessions
+    ("call_sessions", "created_at", "TIMESTAMPTZ NOT NULL DEFAULT now()"),
+    ("call_sessions", "closed_at", "TIMESTAMPTZ"),
+]
+
+# (nom, définition) : CREATE INDEX CONCURRENTLY, hors transaction
+INDEXES = [
+    # user-027
+    ("ix_call_sessions_created_at", "call_sessions (created_at)"),
+    # user-035 : navigation par catégorie KB
+    ("ix_kbase_entries_category_id", "kbase_entries (category, id)"),
+]
+
+
+def _add_column(conn, table: str, column: str, definition: str) -> None:
+    exists = conn.execute(
+        text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column"
+        ),
+        {"table": table, "column": column},
+    ).first()
+    if not exists:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}"))
+
+
+def _create_index(conn, name: str, definition: str) -> None:
+    # un CONCURRENTLY interrompu laisse un index INVALID que IF NOT EXISTS ignorerait
+    invalid = conn.execute(
+        text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ),
+        {"name": name},
+    ).first()
+    if invalid:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"))
+
+
+def _backfill(engine) -> None:
+    # backfill des rollups / facettes au premier démarrage
+    with Session(engine) as db:
+        has_rollups = db.execute(select(models.CallSessionRollup.id).limit(1)).first()
+        has_sessions = db.execute(select(func.count(models.CallSession.id))).scalar()
+        if not has_rollups and has_sessions:
+            inserted = rollups.rebuild(db)
+            db.commit()
+            logger.info(f"[MIGRATIONS] call_session_rollups backfilled ({inserted} rows)")
+
+        has_facets = db.execute(select(models.KbCategoryCount.category).limit(1)).first()
+        has_entries = db.execute(select(models.kbase_entry.id).limit(1)).first()
+        if not has_facets and has_entries:
+            inserted = kb_categories.rebuild(db)
+            db.commit()
+            logger.info(f"[MIGRATIONS] kb_category_counts backfilled ({inserted} categories)")
+
+
+def upgrade(engine) -> None:
+    """create_all + ALTERs + indexes + backfills, once at a time across processes."""
+    # AUTOCOMMIT : CREATE INDEX CONCURRENTLY refuse de tourner dans une transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # verrou de session, tenu par cette connexion jusqu'à l'unlock
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+        try:
+            models.Base.metadata.create_all(bind=engine)
+            for table, column, definition in COLUMNS:
+                _add_column(conn, table, column, definition)
+            for name, definition in INDEXES:
+                _create_index(conn, name, definition)
+            _backfill(engine)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _ADVISORY_LOCK_KEY})
@@ -1,5 +1,9 @@
 from enum import Enum as PyEnum
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Enum
+from datetime import datetime, timezone
+from sqlalchemy import (
+    Column, Integer, SmallInteger, BigInteger, LargeBinary, String, Text, ForeignKey, Enum,
+    DateTime, UniqueConstraint, Index, func
+)
 from sqlalchemy.orm import relationship
 from db.database import Base
 
@@ -14,6 +18,10 @@ class FinalStatus(str, PyEnum):
     NOT_SATISFIED = "not_satisfied"
 
 
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 class Role(str, PyEnum):
     AGENT = "agent"
     ADMIN = "admin"
@@ -61,9 +69,42 @@ class CallSession(Base):
         nullable=False,
     )
 
-    
+    # ouverture / clôture (clôture = premier final_status renseigné)
+    created_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=utcnow,
+        server_default=func.now(),
+        index=True,
+    )
+    closed_at = Column(DateTime(timezone=True), nullable=True)
+
     agent = relationship("Agent", back_populates="call_sessions")
 
+
+class CallSessionRollup(Base):
+    """
+    Pre-aggregated session counts per time bucket (minute / hour / day),
+    agent, client type and final status. Maintained on every session write
+    by db/rollups.py so time-range stats never scan call_sessions.
+    """
+    __tablename__ = "call_session_rollups"
+
+    id = Column(Integer, primary_key=True)
+    bucket = Column(String, nullable=False)  # "minute" | "hour" | "day"
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    agent_id = Column(Integer, nullable=False)
+    client_type = Column(String, nullable=False)
+    final_status = Column(String, nullable=False)  # "" tant que non clôturée
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "bucket", "bucket_start", "agent_id", "client_type", "final_status",
+            name="uq_call_session_rollup",
+        ),
+    )
+
 class kbase_entry(Base):
     __tablename__ = "kbase_entries"
 
@@ -72,3 +113,55 @@ class kbase_entry(Base):
     answer = Column(Text, nullable=False)    
     category = Column(String, nullable=True) 
 
+    # navigation par catégorie + pagination keyset (category, id)
+    __table_args__ = (
+        Index("ix_kbase_entries_category_id", "category", "id"),
+    )
+
+
+class KbMinHash(Base):
+    """MinHash signature of a KB entry (services/kb_dedup.py), written with the entry."""
+    __tablename__ = "kb_minhash"
+
+    entry_id = Column(
+        Integer, ForeignKey("kbase_entries.id", ondelete="CASCADE"), primary_key=True
+    )
+    signature = Column(LargeBinary, nullable=False)  # 128 x uint64, little-endian
+
+
+class KbMinHashBand(Base):
+    """LSH band keys: entries sharing a (band, hash) pair are duplicate candidates."""
+    __tablename__ = "kb_minhash_bands"
+
+    entry_id = Column(
+        Integer, ForeignKey("kbase_entries.id", ondelete="CASCADE"), primary_key=True
+    )
+    band = Column(SmallInteger, primary_key=True)
+    hash = Column(BigInteger, nullable=False)
+
+    __table_args__ = (
+        Index("ix_kb_minhash_bands_band_hash", "band", "hash"),
+    )
+
+
+class KbCategoryCount(Base):
+    """Facet counts per KB category, maintained on every KB write (db/kb_categories.py)."""
+    __tablename__ = "kb_category_counts"
+
+    category = Column(String, primary_key=True)  # "" = sans catégorie
+    count = Column(Integer, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    """
+    Stored responses of writes sent with an Idempotency-Key header
+    (services/idempotency.py). status_code NULL = request still running.
+    """
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)  # "<agent_id>:<route>:<Idempotency-Key>"
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -0,0 +1,305 @@
+# db/rollups.py
+"""
+Incremental time-bucketed aggregates of call sessions.
+
+Every session write adds (+1) or removes (-1) the session from its
+minute / hour / day buckets in `call_session_rollups`, inside the same
+transaction as the write. A session is bucketed by `created_at`, so an
+update only touches rollups when its client type or final status changes.
+
+`rebuild()` recomputes a time window from the raw table plus the archive
+segments (db/archive.py); it backfills existing data and can be run
+periodically to repair drift.
+
+Minute buckets are only kept for ROLLUP_MINUTE_RETENTION_DAYS (hour and
+day rows cover older ranges): writes purge expired minute rows in small
+batches, at most once every PURGE_EVERY_SECONDS per worker, and rebuild()
+doesn't recreate them.
+"""
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+import db.models as models
+
+BUCKETS = ("minute", "hour", "day")
+
+MINUTE_RETENTION_DAYS = int(os.getenv("ROLLUP_MINUTE_RETENTION_DAYS", "7"))
+PURGE_EVERY_SECONDS = 600
+PURGE_BATCH = 5000
+
+_last_purge = 0.0
+
+Rollup = models.CallSessionRollup
+
+# (created_at, agent_id, client_type, final_status, delta)
+Change = Tuple[datetime, int, object, object, int]
+
+
+def _value(v) -> str:
+    if v is None:
+        return ""
+    return getattr(v, "value", v)
+
+
+def _utc(ts: datetime) -> datetime:
+    # naïf = déjà UTC
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc)
+
+
+def bucket_start(ts: datetime, bucket: str) -> datetime:
+    # buckets alignés en UTC
+    ts = _utc(ts)
+    if bucket == "minute":
+        return ts.replace(second=0, microsecond=0)
+    if bucket == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"unknown bucket {bucket!r}")
+
+
+def minute_cutoff() -> datetime:
+    """Minute rows before this instant are purged (day-aligned, UTC)."""
+    return bucket_start(models.utcnow() - timedelta(days=MINUTE_RETENTION_DAYS), "day")
+
+
+def purge_minutes(db: Session, limit: int = PURGE_BATCH) -> int:
+    """Delete up to `limit` expired minute rows. Does not commit."""
+    expired = (
+        select(Rollup.id)
+        .where(Rollup.bucket == "minute", Rollup.bucket_start < minute_cutoff())
+        .limit(limit)
+        .scalar_subquery()
+    )
+    return db.execute(delete(Rollup).where(Rollup.id.in_(expired))).rowcount
+
+
+def _maybe_purge(db: Session) -> None:
+    global _last_purge
+    if time.monotonic() - _last_purge < PURGE_EVERY_SECONDS:
+        return
+    _last_purge = time.monotonic()
+    purge_minutes(db)
+
+
+def make_key(created_at, agent_id, client_type, final_status) -> Tuple[datetime, int, str, str]:
+    return (created_at, agent_id, _value(client_type), _value(final_status))
+
+
+def session_key(session_obj) -> Tuple[datetime, int, str, str]:
+    return make_key(
+        session_obj.created_at,
+        session_obj.agent_id,
+        session_obj.client_type,
+        session_obj.final_status,
+    )
+
+
+def record(db: Session, changes: Iterable[Change]) -> None:
+    """
+    Apply +/- deltas to every bucket of every change in one upsert.
+    Does not commit: call it before the write's own `db.commit()`.
+    """
+    totals = defaultdict(int)
+    for created_at, agent_id, client_type, final_status, delta in changes:
+        for bucket in BUCKETS:
+            key = (
+                bucket,
+                bucket_start(created_at, bucket),
+                agent_id,
+                _value(client_type),
+                _value(final_status),
+            )
+            totals[key] += delta
+
+    rows = [
+        {
+            "bucket": bucket,
+            "bucket_start": start,
+            "agent_id": agent_id,
+            "client_type": client_type,
+            "final_status": final_status,
+            "count": delta,
+        }
+        for (bucket, start, agent_id, client_type, final_status), delta in totals.items()
+        if delta
+    ]
+    if not rows:
+        return
+
+    stmt = pg_insert(Rollup).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_call_session_rollup",
+        set_={"count": Rollup.count + stmt.excluded.count},
+    )
+    db.execute(stmt)
+    # lot borné, dans la transaction de l'écriture
+    _maybe_purge(db)
+
+
+def record_created(db: Session, session_obj) -> None:
+    record(db, [(*session_key(session_obj), 1)])
+
+
+def record_deleted(db: Session, session_obj) -> None:
+    record(db, [(*session_key(session_obj), -1)])
+
+
+def record_updated(db: Session, old_key, session_obj) -> None:
+    new_key = session_key(session_obj)
+    if old_key == new_key:
+        return
+    record(db, [(*old_key, -1), (*new_key, 1)])
+
+
+def _archived_totals(db: Session, start: Optional[datetime], end: Optional[datetime]) -> dict:
+    """Bucket counts of archived sessions in [start, end), same keys as record()."""
+    from db import archive  # archive -> models seulement, pas de cycle
+
+    totals = defaultdict(int)
+    CallSession = models.CallSession
+    for entry, columns in archive.iter_segments():
+        # une ligne encore présente en base (commit d'archivage raté) compte une fois
+        hot = set(
+            db.execute(
+                select(CallSession.id).where(CallSession.id.between(entry["min_id"], entry["max_id"]))
+            ).scalars()
+        )
+        for i, session_id in enumerate(columns["id"]):
+            if session_id in hot:
+                continue
+            created_at = _utc(datetime.fromisoformat(columns["created_at"][i]))
+            if (start is not None and created_at < _utc(start)) or (end is not None and created_at >= _utc(end)):
+                continue
+            for bucket in BUCKETS:
+                key = (
+                    bucket,
+                    bucket_start(created_at, bucket),
+                    columns["agent_id"][i],
+                    _value(columns["client_type"][i]),
+                    _value(columns["final_status"][i]),
+                )
+                totals[key] += 1
+    return totals
+
+
+def rebuild(db: Session, start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+    """
+    Recompute rollups for [start, end) from call_sessions and the archived
+    sessions (all history when no bounds are given). Bounds should be
+    aligned on day boundaries so no bucket is partially recomputed.
+    Does not commit.
+    """
+    CallSession = models.CallSession
+    window = []
+    if start is not None:
+        window.append(CallSession.created_at >= start)
+    if end is not None:
+        window.append(CallSession.created_at < end)
+
+    rollup_window = []
+    if start is not None:
+        rollup_window.append(Rollup.bucket_start >= start)
+    if end is not None:
+        rollup_window.append(Rollup.bucket_start < end)
+    db.execute(delete(Rollup).where(*rollup_window))
+
+    archived = _archived_totals(db, start, end)
+    cutoff = minute_cutoff()
+
+    inserted = 0
+    for bucket in BUCKETS:
+        where = list(window)
+        if bucket == "minute":
+            # rétention : pas de minutes avant la limite
+            where.append(CallSession.created_at >= cutoff)
+        start_col = func.date_trunc(bucket, CallSession.created_at, "UTC")
+        grouped = (
+            select(
+                start_col,
+                CallSession.agent_id,
+                CallSession.client_type,
+                CallSession.final_status,
+                func.count(CallSession.id),
+            )
+            .where(*where)
+            .group_by(start_col, CallSession.agent_id, CallSession.client_type, CallSession.final_status)
+        )
+        totals = defaultdict(int)
+        for ts, agent_id, client_type, final_status, count in db.execute(grouped):
+            totals[(bucket, ts, agent_id, _value(client_type), _value(final_status))] += count
+        for key, count in archived.items():
+            if key[0] == bucket and (bucket != "minute" or key[1] >= cutoff):
+                totals[key] += count
+        rows = [
+            {
+                "bucket": bucket,
+                "bucket_start": ts,
+                "agent_id": agent_id,
+                "client_type": client_type,
+                "final_status": final_status,
+                "count": count,
+            }
+            for (bucket, ts, agent_id, client_type, final_status), count in totals.items()
+        ]
+        if rows:
+            db.execute(pg_insert(Rollup).values(rows))
+            inserted += len(rows)
+    return inserted
+
+
+def timeseries(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    bucket: str,
+    agent_id: Optional[int] = None,
+):
+    """Read-only over call_session_rollups; never touches call_sessions."""
+    query = (
+        select(
+            Rollup.bucket_start,
+            Rollup.agent_id,
+            Rollup.client_type,
+            Rollup.final_status,
+            func.sum(Rollup.count),
+        )
+        .where(
+            Rollup.bucket == bucket,
+            Rollup.bucket_start >= bucket_start(start, bucket),
+            Rollup.bucket_start < end,
+        )
+        .group_by(Rollup.bucket_start, Rollup.agent_id, Rollup.client_type, Rollup.final_status)
+        .order_by(Rollup.bucket_start)
+    )
+    if agent_id is not None:
+        query = query.where(Rollup.agent_id == agent_id)
+
+    points = {}
+    for ts, row_agent_id, client_type, final_status, count in db.execute(query):
+        if not count:
+            continue
+        point = points.setdefault(
+            ts,
+            {
+                "bucket_start": ts,
+                "total": 0,
+                "by_client_type": defaultdict(int),
+                "by_final_status": defaultdict(int),
+                "by_agent": defaultdict(int),
+            },
+        )
+        point["total"] += count
+        point["by_client_type"][client_type] += count
+        point["by_final_status"][final_status or "open"] += count
+        point["by_agent"][row_agent_id] += count
+    return list(points.values())
@@ -1,11 +1,19 @@
 # main.py
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response
 from db.database import engine, SessionLocal
+from db import migrations
 from api.router import api_router
 import db.models as models
 from auth.security import verify_token, get_current_admin
+from services.singleflight import singleflight
+from services.events import broker
+from services.warmup import state as readiness, warm_up
+import asyncio
 import logging
+import signal
+from contextlib import asynccontextmanager
 from sqlalchemy import text
 
 #test the api connection to the database
@@ -13,9 +21,84 @@ from sqlalchemy import text
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("doxa")
 
-models.Base.metadata.create_all(bind=engine)
+# create_all + migrations : lancés par serve.py / __main__, pas à l'import
+# (sinon chaque worker et chaque redémarrage --max-requests les rejoue)
 
-app = FastAPI()
+def _close_streams_on_sigterm() -> None:
+    """
+    Server drain waits for open responses, and SSE / WebSocket feeds never
+    end on their own: close them as soon as SIGTERM arrives, then hand the
+    signal to the server's own handler.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def on_sigterm(signum, frame):
+            # /readyz passe à 503 : le load balancer arrête d'envoyer du trafic
+            readiness.draining = True
+            loop.call_soon_threadsafe(broker.close)
+            if callable(previous):
+                previous(signum, frame)
+
+        signal.signal(signal.SIGTERM, on_sigterm)
+    except ValueError:
+        # pas dans le thread principal (ex. TestClient) : rien à faire
+        pass
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    _close_streams_on_sigterm()
+    # LISTEN/NOTIFY (multi-worker) : un thread d'écoute par worker
+    broker.backplane.start()
+    # warm-up en arrière-plan : /healthz répond tout de suite, /readyz après
+    warmup = asyncio.get_running_loop().run_in_executor(None, warm_up, app)
+    yield
+    readiness.draining = True
+    await warmup
+    # SIGTERM: le serveur a fini de drainer les requêtes en cours
+    logger.info("[LIFESPAN] shutting down - closing event streams and DB pool")
+    broker.close()
+    broker.backplane.stop()
+    engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+# request coalescing: dashboards refresh these in bursts
+COALESCED_PATHS = {
+    "/call-sessions/stats",
+    "/call-sessions/stats/timeseries",
+    "/kb/all",
+    "/agents/all",
+    "/agents/leaderboard",
+}
+
+
+# declared first = innermost: runs after JWT auth has set current_agent
+@app.middleware("http")
+async def coalescing_middleware(request: Request, call_next):
+    if request.method != "GET" or request.url.path not in COALESCED_PATHS:
+        return await call_next(request)
+
+    # ces routes renvoient la même chose à tout agent authentifié :
+    # le rôle suffit comme périmètre d'autorisation
+    agent = getattr(request.state, "current_agent", None)
+    key = (
+        request.url.path,
+        tuple(sorted(request.query_params.multi_items())),
+        getattr(agent, "role", None),
+    )
+
+    async def compute():
+        response = await call_next(request)
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        return response.status_code, dict(response.headers), body
+
+    status_code, headers, body = await singleflight.do(key, compute)
+    return Response(content=body, status_code=status_code, headers=headers)
 
 
 # roles
@@ -54,6 +137,8 @@ async def jwt_auth_middleware(request: Request, call_next):
     # Allow unauthenticated paths: only the login endpoint and docs/openapi
     if (
         path == "/auth/login"
+        or path == "/healthz"
+        or path == "/readyz"
         or path.startswith("/openapi.json")
         or path.startswith("/docs")
         or path.startswith("/redoc")
@@ -115,12 +200,17 @@ async def jwt_auth_middleware(request: Request, call_next):
     return response
 
 
+# outermost: compresses the final body when the client sends Accept-Encoding: gzip
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 app.include_router(api_router)
 
 
 if __name__ == "__main__":
-    # Run with: python main.py  (binds to 0.0.0.0)
+    # Dev server: python main.py  (binds to 0.0.0.0, auto-reload)
+    # Production: python serve.py  (multi-worker, see serve.py)
     import uvicorn
+    migrations.upgrade(engine)
     uvicorn.run("main:app", host="0.0.0.0", port=7000, reload=True)
 
 
@@ -0,0 +1,124 @@
+# serve.py
+"""
+Production entry point (main.py's __main__ is the dev server with reload).
+
+    python serve.py                          # one worker per core, port 7000
+    python serve.py --workers 4 --preload    # gunicorn + uvicorn workers, app imported once
+
+- workers: --workers, else WEB_CONCURRENCY, else one per CPU core
+- uvloop / httptools are picked automatically when installed
+- each worker is recycled after --max-requests (+ jitter) to cap memory growth
+- SIGTERM: stop accepting, finish in-flight requests (up to --graceful-timeout),
+  then the app's lifespan shutdown closes event streams and the DB pool
+- create_all / migrations run once here, in the parent, before any worker
+  starts (main.py no longer runs them at import)
+- gunicorn (requirements.txt) is the default: with --preload the app is
+  imported once in the master before forking; each worker then resets the
+  inherited DB pool. Without gunicorn, uvicorn's own process manager is used.
+"""
+import argparse
+import multiprocessing
+import os
+
+
+def default_workers() -> int:
+    return int(os.getenv("WEB_CONCURRENCY", "0")) or multiprocessing.cpu_count()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the API in production mode")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "7000")))
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("MAX_REQUESTS", "10000")),
+                        help="recycle a worker after N requests (0 = never)")
+    parser.add_argument("--max-requests-jitter", type=int, default=int(os.getenv("MAX_REQUESTS_JITTER", "1000")),
+                        help="random extra requests so workers don't all restart together (gunicorn only)")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+                        help="seconds to drain in-flight requests on SIGTERM")
+    parser.add_argument("--preload", action="store_true",
+                        help="import the app once before forking workers (requires gunicorn)")
+    return parser.parse_args()
+
+
+def _post_fork(server, worker):
+    # le pool hérité du master ne doit pas être partagé entre processus
+    from db.database import engine
+    engine.dispose(close=False)
+
+
+def run_gunicorn(args) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    try:
+        from uvicorn_worker import UvicornWorker  # noqa: F401
+        worker_class = "uvicorn_worker.UvicornWorker"
+    except ImportError:
+        worker_class = "uvicorn.workers.UvicornWorker"
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{args.host}:{args.port}")
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("worker_class", worker_class)
+            self.cfg.set("preload_app", args.preload)
+            self.cfg.set("max_requests", args.max_requests)
+            self.cfg.set("max_requests_jitter", args.max_requests_jitter)
+            self.cfg.set("graceful_timeout", args.graceful_timeout)
+            self.cfg.set("post_fork", _post_fork)
+
+        def load(self):
+            from main import app
+            return app
+
+    Server().run()
+
+
+def migrate_once() -> None:
+    # dans le parent, avant les workers (qui n'importent main que pour l'app)
+    from db import migrations
+    from db.database import engine
+
+    migrations.upgrade(engine)
+    engine.dispose()
+
+
+def run_uvicorn(args) -> None:
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="auto",   # uvloop si installé
+        http="auto",   # httptools si installé
+        limit_max_requests=args.max_requests or None,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+        reload=False,
+    )
+
+
+def main() -> None:
+    args = parse_args()
+    # lu par les workers (ex. services/events.py : LISTEN/NOTIFY si > 1)
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    try:
+        import gunicorn  # noqa: F401
+        has_gunicorn = True
+    except ImportError:
+        has_gunicorn = False
+
+    if args.preload and not has_gunicorn:
+        raise SystemExit("--preload requires gunicorn (pip install gunicorn)")
+
+    migrate_once()
+    if has_gunicorn:
+        run_gunicorn(args)
+    else:
+        run_uvicorn(args)
+
+
+if __name__ == "__main__":
+    main()
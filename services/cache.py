@@ -0,0 +1,63 @@
+# services/cache.py
+"""
+Small in-process TTL cache.
+
+Entries expire after `ttl` seconds; writers call `clear()` to invalidate
+early. Each worker has its own copy, so the TTL bounds how stale a worker
+can be after a write handled by another worker.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    def __init__(self, ttl: float, maxsize: int = 256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+# classement des agents : invalidé à chaque écriture de call session
+leaderboard_cache = TTLCache(ttl=30)
+
+# annuaire id -> {id, email, number} pour ?include=agent ;
+# invalidé sur écriture d'agent dans ce worker seulement : le TTL borne le
+# retard des autres workers (même ordre que le classement).
+# AGENT_DIRECTORY_TTL=0 le désactive
+agent_directory = TTLCache(ttl=float(os.getenv("AGENT_DIRECTORY_TTL", "30")), maxsize=10_000)
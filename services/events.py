@@ -0,0 +1,344 @@
+# services/events.py
+"""
+Live change feed for call sessions and KB entries.
+
+Handlers publish small events after a successful commit; WebSocket / SSE
+subscribers receive them through a bounded per-subscriber queue. A
+subscriber that can't keep up is dropped instead of slowing the publisher.
+
+Fan-out goes through a `Backplane`:
+
+- `LocalBackplane` delivers inside the current process (single worker).
+- `PostgresBackplane` publishes with NOTIFY and runs one LISTEN thread per
+  worker that calls `broker.dispatch()` for every notification, so every
+  worker sees every write. It is the default when WEB_CONCURRENCY > 1
+  (serve.py sets it); EVENTS_BACKPLANE=local|postgres forces a choice.
+"""
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("doxa.events")
+
+NOTIFY_CHANNEL = "doxa_events"
+# limite Postgres : 8000 octets par payload NOTIFY
+NOTIFY_MAX_BYTES = 7900
+LISTEN_RETRY_SECONDS = 5
+
+# taille max de la file d'un abonné avant de le déconnecter
+SUBSCRIBER_QUEUE_SIZE = 256
+
+TOPIC_CALL_SESSIONS = "call_sessions"
+TOPIC_KB = "kb"
+
+# sentinelle envoyée à un abonné trop lent (ou à l'arrêt du broker)
+DROPPED = object()
+
+
+def _value(v):
+    # Enum -> valeur brute pour pouvoir comparer / sérialiser
+    return getattr(v, "value", v)
+
+
+class Subscription:
+    def __init__(
+        self,
+        broker: "EventBroker",
+        loop: asyncio.AbstractEventLoop,
+        topics: Optional[set] = None,
+        agent_id: Optional[int] = None,
+        client_type: Optional[str] = None,
+        final_status: Optional[str] = None,
+        maxsize: int = SUBSCRIBER_QUEUE_SIZE,
+    ):
+        self.broker = broker
+        self.loop = loop
+        self.topics = topics
+        self.agent_id = agent_id
+        self.client_type = _value(client_type)
+        self.final_status = _value(final_status)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = False
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if self.topics and event["topic"] not in self.topics:
+            return False
+        # les filtres agent / type / statut ne concernent que les sessions
+        if event["topic"] != TOPIC_CALL_SESSIONS:
+            return True
+        data = event.get("data") or {}
+        if self.agent_id is not None and data.get("agent_id") != self.agent_id:
+            return False
+        if self.client_type is not None and data.get("client_type") != self.client_type:
+            return False
+        if self.final_status is not None and data.get("final_status") != self.final_status:
+            return False
+        return True
+
+    def offer(self, event) -> None:
+        """Runs on the subscriber's event loop."""
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning("[EVENTS] slow subscriber dropped (queue full)")
+            self.broker.dropped += 1
+            self.close()
+
+    def close(self) -> None:
+        """Runs on the subscriber's event loop."""
+        if self.dropped:
+            return
+        self.dropped = True
+        self.broker.unsubscribe(self)
+        # vider la file pour que la sentinelle passe en premier
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(DROPPED)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class LocalBackplane:
+    """In-process: every published message is dispatched locally."""
+
+    name = "local"
+
+    def __init__(self):
+        self.broker: Optional["EventBroker"] = None
+
+    def attach(self, broker: "EventBroker") -> None:
+        self.broker = broker
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    @property
+    def connected(self) -> bool:
+        return True
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        if self.broker is not None:
+            self.broker.dispatch(event)
+
+
+def _notify_payload(event: Dict[str, Any]) -> str:
+    payload = json.dumps(event, separators=(",", ":"), default=str)
+    if len(payload.encode("utf-8")) <= NOTIFY_MAX_BYTES:
+        return payload
+    # textes longs (reason / result / question) : on garde les champs de filtre
+    data = {
+        k: v for k, v in event["data"].items()
+        if not isinstance(v, str) or len(v) <= 200
+    }
+    return json.dumps({**event, "data": data, "truncated": True}, separators=(",", ":"), default=str)
+
+
+class PostgresBackplane(LocalBackplane):
+    """
+    Cross-worker fan-out over Postgres LISTEN/NOTIFY.
+
+    NOTIFY goes through a pooled connection; the LISTEN side uses its own
+    connection, detached from the pool, in a daemon thread. Postgres also
+    delivers to the publishing worker's listener, so nothing is dispatched
+    locally, except while the listener is disconnected.
+    """
+
+    name = "postgres"
+
+    def __init__(self, channel: str = NOTIFY_CHANNEL):
+        super().__init__()
+        self.channel = channel
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._listening = False
+
+    @property
+    def connected(self) -> bool:
+        return self._listening
+
+    def start(self) -> None:
+        """Per worker (app lifespan), never in a pre-fork parent."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen_forever, name="events-listen", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=LISTEN_RETRY_SECONDS)
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        if not self._listening:
+            # pas d'écoute : au moins les abonnés de ce worker
+            super().publish(event)
+            return
+        from sqlalchemy import text
+        from db.database import engine
+
+        with engine.connect() as conn:
+            conn.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": self.channel, "payload": _notify_payload(event)},
+            )
+            conn.commit()
+
+    # ---------- écoute ----------
+
+    def _listen_forever(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                logger.warning(f"[EVENTS] LISTEN connection lost, retrying in {LISTEN_RETRY_SECONDS}s: {e}")
+            finally:
+                self._listening = False
+            self._stop.wait(LISTEN_RETRY_SECONDS)
+
+    def _listen(self) -> None:
+        from db.database import engine
+
+        pooled = engine.raw_connection()
+        pooled.detach()  # connexion dédiée : ne retourne jamais au pool
+        conn = pooled.driver_connection
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f'LISTEN "{self.channel}"')
+            self._listening = True
+            logger.info(f"[EVENTS] listening on {self.channel}")
+            while not self._stop.is_set():
+                # réveil régulier pour voir _stop
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    if self.broker is not None:
+                        self.broker.dispatch(json.loads(notify.payload))
+        finally:
+            self._listening = False
+            pooled.close()
+
+
+def _default_backplane() -> LocalBackplane:
+    choice = os.getenv("EVENTS_BACKPLANE")
+    if choice is None:
+        workers = int(os.getenv("WEB_CONCURRENCY", "1") or "1")
+        choice = "postgres" if workers > 1 else "local"
+    if choice == "postgres":
+        return PostgresBackplane()
+    return LocalBackplane()
+
+
+class EventBroker:
+    def __init__(self, backplane=None):
+        self._lock = threading.Lock()
+        self._subscribers: set = set()
+        self.backplane = backplane or _default_backplane()
+        self.backplane.attach(self)
+        self.published = 0
+        self.dropped = 0
+
+    # ---------- abonnés ----------
+
+    def subscribe(self, **filters) -> Subscription:
+        sub = Subscription(self, asyncio.get_running_loop(), **filters)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    # ---------- publication ----------
+
+    def publish(self, topic: str, action: str, data: Dict[str, Any]) -> None:
+        """
+        Safe to call from sync handlers (threadpool) and from the event loop.
+        Never blocks: delivery is scheduled on each subscriber's loop.
+        """
+        event = {
+            "topic": topic,
+            "type": f"{topic}.{action}",
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "data": {k: _value(v) for k, v in data.items()},
+        }
+        self.published += 1
+        try:
+            self.backplane.publish(event)
+        except Exception:
+            # le flux live ne doit jamais faire échouer une écriture
+            logger.exception("[EVENTS] publish failed")
+
+    def dispatch(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            if not sub.matches(event):
+                continue
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, event)
+            except RuntimeError:
+                # boucle fermée : l'abonné est parti
+                self.unsubscribe(sub)
+
+    def close(self) -> None:
+        """Disconnect every subscriber (used on shutdown)."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            try:
+                sub.loop.call_soon_threadsafe(sub.close)
+            except RuntimeError:
+                self.unsubscribe(sub)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": self.subscriber_count,
+            "published": self.published,
+            "dropped": self.dropped,
+            "backplane": self.backplane.name,
+            "backplane_connected": self.backplane.connected,
+        }
+
+
+broker = EventBroker()
+
+
+def call_session_event(session_obj) -> Dict[str, Any]:
+    # à capturer avant le commit pour un DELETE (l'objet est détaché ensuite)
+    return {
+        "id": session_obj.id,
+        "agent_id": session_obj.agent_id,
+        "client_type": session_obj.client_type,
+        "reason": session_obj.reason,
+        "result": session_obj.result,
+        "final_status": session_obj.final_status,
+    }
+
+
+def kb_event(kb_entry) -> Dict[str, Any]:
+    return {
+        "id": kb_entry.id,
+        "question": kb_entry.question,
+        "category": kb_entry.category,
+    }
@@ -0,0 +1,205 @@
+# services/idempotency.py
+"""
+Idempotency-Key support for retried writes.
+
+The first request with a given key claims a row in `idempotency_keys`
+(INSERT ... ON CONFLICT DO NOTHING), runs the write and stores its
+response in the same transaction as the write, so a key is never left
+pending once the write is committed. A retry with the same key and the same payload digest gets the
+stored response back without touching the target table; a different
+payload under the same key is rejected with 422.
+
+Duplicates that arrive while the first request is still running wait for
+it: in-process with an Event, across workers by polling the claimed row.
+Recent completed keys are also kept in an in-process LRU so most retries
+never reach the DB. Keys expire after IDEMPOTENCY_TTL_SECONDS.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.responses import Response
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+import db.models as models
+from services.cache import TTLCache
+
+KEY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# un claim "en cours" plus vieux que ça est considéré abandonné (worker mort)
+PENDING_TIMEOUT_SECONDS = 60
+WAIT_TIMEOUT_SECONDS = 30
+PURGE_EVERY_SECONDS = 600
+
+Keys = models.IdempotencyKey
+
+# (request_hash, status_code, body)
+Stored = Tuple[str, int, str]
+
+
+def payload_digest(payload: Dict[str, Any]) -> str:
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self):
+        self.recent = TTLCache(ttl=KEY_TTL_SECONDS, maxsize=10_000)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._last_purge = 0.0
+        self.replayed = 0
+
+    # ---------- API ----------
+
+    def execute(
+        self,
+        db: Session,
+        key: str,
+        digest: str,
+        fn: Callable[[], str],
+        status_code: int = 200,
+    ) -> Response:
+        """
+        Run `fn` at most once per `key`; replays the stored response
+        otherwise. `fn` performs the write WITHOUT committing and returns
+        the JSON body: the commit here covers both the write and the key.
+        """
+        deadline = time.monotonic() + WAIT_TIMEOUT_SECONDS
+        while True:
+            stored = self.recent.get(key)
+            if stored is not None:
+                return self._replay(stored, digest)
+
+            with self._lock:
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    leader = True
+                else:
+                    leader = False
+
+            if not leader:
+                # même worker : on attend la fin du premier puis on relit
+                if not event.wait(max(0.0, deadline - time.monotonic())):
+                    self._in_progress()
+                continue
+
+            try:
+                return self._execute_leader(db, key, digest, fn, status_code, deadline)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+
+    # ---------- interne ----------
+
+    def _execute_leader(self, db, key, digest, fn, status_code, deadline) -> Response:
+        self._maybe_purge(db)
+        while True:
+            if self._claim(db, key, digest):
+                break
+            row = db.execute(
+                select(Keys.request_hash, Keys.status_code, Keys.response_body).where(Keys.key == key)
+            ).first()
+            db.rollback()
+            if row is None:
+                continue  # expiré / libéré entre-temps : on retente le claim
+            if row.request_hash != digest:
+                self._mismatch()
+            if row.status_code is not None:
+                stored = (row.request_hash, row.status_code, row.response_body)
+                self.recent.set(key, stored)
+                return self._replay(stored, digest)
+            # un autre worker exécute la même requête
+            if time.monotonic() > deadline:
+                self._in_progress()
+            time.sleep(0.1)
+
+        try:
+            body = fn()
+            # même transaction que l'écriture : tout ou rien
+            db.execute(
+                update(Keys)
+                .where(Keys.key == key)
+                .values(status_code=status_code, response_body=body)
+            )
+            db.commit()
+        except Exception:
+            # libère la clé : un nouvel essai pourra ré-exécuter
+            db.rollback()
+            db.execute(delete(Keys).where(Keys.key == key))
+            db.commit()
+            raise
+
+        self.recent.set(key, (digest, status_code, body))
+        return Response(content=body, status_code=status_code, media_type="application/json")
+
+    def _claim(self, db: Session, key: str, digest: str) -> bool:
+        now = models.utcnow()
+        # reprise d'un claim abandonné ou expiré
+        db.execute(
+            delete(Keys).where(
+                Keys.key == key,
+                (Keys.expires_at < now)
+                | (Keys.status_code.is_(None) & (Keys.created_at < now - timedelta(seconds=PENDING_TIMEOUT_SECONDS))),
+            )
+        )
+        claimed = db.execute(
+            pg_insert(Keys)
+            .values(
+                key=key,
+                request_hash=digest,
+                created_at=now,
+                expires_at=now + timedelta(seconds=KEY_TTL_SECONDS),
+            )
+            .on_conflict_do_nothing(index_elements=[Keys.key])
+            .returning(Keys.key)
+        ).first()
+        db.commit()
+        return claimed is not None
+
+    def _maybe_purge(self, db: Session) -> None:
+        if time.monotonic() - self._last_purge < PURGE_EVERY_SECONDS:
+            return
+        self._last_purge = time.monotonic()
+        db.execute(delete(Keys).where(Keys.expires_at < models.utcnow()))
+        db.commit()
+
+    def _replay(self, stored: Stored, digest: str) -> Response:
+        request_hash, status_code, body = stored
+        if request_hash != digest:
+            self._mismatch()
+        self.replayed += 1
+        return Response(
+            content=body,
+            status_code=status_code,
+            media_type="application/json",
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+    @staticmethod
+    def _mismatch():
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key déjà utilisée avec un contenu différent",
+        )
+
+    @staticmethod
+    def _in_progress():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Une requête avec cette Idempotency-Key est toujours en cours",
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {"recent": self.recent.stats()["size"], "replayed": self.replayed}
+
+
+idempotency = IdempotencyStore()
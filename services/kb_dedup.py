@@ -0,0 +1,255 @@
+# services/kb_dedup.py
+"""
+Near-duplicate detection for knowledge-base entries (MinHash + LSH).
+
+Each entry's question + answer is normalized and cut into word 3-gram
+shingles; a 128-value MinHash signature estimates Jaccard similarity
+between entries. Signatures are split into 16 bands of 8 rows: entries
+sharing any band become candidates, so a lookup or a full clustering
+never compares all pairs.
+
+The index lives in the DB, not in the workers: every KB write stores the
+entry's signature (`kb_minhash`, 1 KB) and its 16 band keys
+(`kb_minhash_bands`, indexed on (band, hash)) in its own transaction, and
+deletes cascade. Lookups are one indexed query for the candidates plus one
+for their signatures, so workers hold nothing in memory, never reload the
+KB at startup, and always see other workers' creates, edits and deletes.
+Entries written before this table existed are signed in the background
+after warm-up (services/warmup.py), by one worker at a time; until then
+they are simply not candidates.
+
+Hash family: h_i(x) = (a_i * x + b_i) mod (2^61 - 1), a universal family
+whose minimum gives an unbiased Jaccard estimate (SD ~ sqrt(J(1-J)/128)).
+
+With 16 x 8 bands, a pair at similarity s becomes a candidate with
+probability 1 - (1 - s^8)^16: 95% at 0.8, 61% at 0.7, 6% at 0.5. Thresholds
+below MIN_THRESHOLD would silently miss most pairs, so they are refused.
+"""
+import hashlib
+import os
+import random
+import re
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert as pg_insert
+from sqlalchemy.orm import Session
+
+import db.models as models
+
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+# rappel LSH >= 95 % à partir de ce seuil (voir docstring)
+MIN_THRESHOLD = 0.8
+
+# "warn" : crée l'entrée et signale les doublons, "reject" : 409, "off"
+DUPLICATE_MODE = os.getenv("KB_DUPLICATE_MODE", "warn")
+DUPLICATE_THRESHOLD = max(MIN_THRESHOLD, float(os.getenv("KB_DUPLICATE_THRESHOLD", "0.8")))
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x6B62)  # fixe : mêmes signatures d'un worker à l'autre
+_COEFFS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+Signature = array  # array('Q') de NUM_PERM valeurs
+
+Sig = models.KbMinHash
+Band = models.KbMinHashBand
+Entry = models.kbase_entry
+
+
+def shingles(text: str) -> set:
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {
+        " ".join(words[i:i + SHINGLE_SIZE])
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def signature(text: str) -> Signature:
+    hashes = [
+        int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") % _PRIME
+        for s in shingles(text)
+    ]
+    if not hashes:
+        return array("Q", [_PRIME] * NUM_PERM)
+    return array("Q", [min([(a * x + b) % _PRIME for x in hashes]) for a, b in _COEFFS])
+
+
+def entry_text(question: str, answer: str) -> str:
+    return f"{question}\n{answer}"
+
+
+def entry_signature(question: str, answer: str) -> Signature:
+    return signature(entry_text(question, answer))
+
+
+def similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+
+def _pack(sig: Signature) -> bytes:
+    if sys.byteorder == "big":
+        sig = array("Q", sig)
+        sig.byteswap()
+    return sig.tobytes()
+
+
+def _unpack(blob: bytes) -> Signature:
+    sig = array("Q")
+    sig.frombytes(blob)
+    if sys.byteorder == "big":
+        sig.byteswap()
+    return sig
+
+
+def band_keys(sig: Signature) -> List[Tuple[int, int]]:
+    # hash 64 bits signé : colonne BIGINT
+    return [
+        (
+            band,
+            int.from_bytes(
+                hashlib.blake2b(_pack(sig[band * ROWS:(band + 1) * ROWS]), digest_size=8).digest(),
+                "little",
+                signed=True,
+            ),
+        )
+        for band in range(BANDS)
+    ]
+
+
+class MinHashIndex:
+    def __init__(self):
+        self.lookups = 0
+        self.scored = 0
+
+    # ---------- écriture (dans la transaction de l'entrée, sans commit) ----------
+
+    def store(self, db: Session, items: Iterable[Tuple[int, Signature]]) -> None:
+        sig_rows, band_rows = [], []
+        for entry_id, sig in items:
+            sig_rows.append({"entry_id": entry_id, "signature": _pack(sig)})
+            band_rows.extend(
+                {"entry_id": entry_id, "band": band, "hash": key} for band, key in band_keys(sig)
+            )
+        if not sig_rows:
+            return
+        stmt = pg_insert(Sig).values(sig_rows)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[Sig.entry_id], set_={"signature": stmt.excluded.signature}
+        ))
+        stmt = pg_insert(Band).values(band_rows)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[Band.entry_id, Band.band], set_={"hash": stmt.excluded.hash}
+        ))
+
+    def backfill(self, db: Session, batch_size: int = 500, should_stop=lambda: False) -> int:
+        """Sign entries that have no signature yet; commits every batch."""
+        done = 0
+        while not should_stop():
+            rows = db.execute(
+                select(Entry.id, Entry.question, Entry.answer)
+                .outerjoin(Sig, Sig.entry_id == Entry.id)
+                .where(Sig.entry_id.is_(None))
+                .order_by(Entry.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                return done
+            self.store(db, [(row.id, entry_signature(row.question, row.answer)) for row in rows])
+            db.commit()
+            done += len(rows)
+        return done
+
+    # ---------- lecture ----------
+
+    def _signatures(self, db: Session, ids: Iterable[int]) -> Dict[int, Signature]:
+        ids = list(ids)
+        found = {}
+        for i in range(0, len(ids), 10_000):
+            for entry_id, blob in db.execute(
+                select(Sig.entry_id, Sig.signature).where(Sig.entry_id.in_(ids[i:i + 10_000]))
+            ):
+                found[entry_id] = _unpack(blob)
+        return found
+
+    def find_similar(
+        self,
+        db: Session,
+        sig: Signature,
+        threshold: float = DUPLICATE_THRESHOLD,
+        exclude_id: Optional[int] = None,
+    ) -> List[Tuple[int, float]]:
+        self.lookups += 1
+        query = select(Band.entry_id).where(
+            tuple_(Band.band, Band.hash).in_(band_keys(sig))
+        ).distinct()
+        if exclude_id is not None:
+            query = query.where(Band.entry_id != exclude_id)
+        candidates = db.execute(query).scalars().all()
+        if not candidates:
+            return []
+        self.scored += len(candidates)
+        scored = [
+            (entry_id, similarity(sig, other))
+            for entry_id, other in self._signatures(db, candidates).items()
+        ]
+        return sorted(
+            [(entry_id, score) for entry_id, score in scored if score >= threshold],
+            key=lambda item: -item[1],
+        )
+
+    def clusters(self, db: Session, threshold: float = DUPLICATE_THRESHOLD) -> List[List[int]]:
+        """
+        Groups of near-duplicate entries (union-find over LSH buckets).
+        Inside a bucket every member is only compared with the bucket's
+        smallest id, which keeps the work linear in the number of entries.
+        """
+        buckets = db.execute(
+            select(func.array_agg(aggregate_order_by(Band.entry_id, Band.entry_id)))
+            .group_by(Band.band, Band.hash)
+            .having(func.count() > 1)
+        ).scalars().all()
+        signatures = self._signatures(db, {entry_id for bucket in buckets for entry_id in bucket})
+
+        parent: Dict[int, int] = {}
+
+        def find(x: int) -> int:
+            parent.setdefault(x, x)
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        def union(a: int, b: int) -> None:
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+
+        for members in buckets:
+            head = members[0]
+            for other in members[1:]:
+                self.scored += 1
+                if similarity(signatures[head], signatures[other]) >= threshold:
+                    union(head, other)
+
+        groups: Dict[int, List[int]] = {}
+        for entry_id in parent:
+            groups.setdefault(find(entry_id), []).append(entry_id)
+        return sorted(
+            (sorted(ids) for ids in groups.values() if len(ids) > 1),
+            key=lambda ids: (-len(ids), ids[0]),
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {"lookups": self.lookups, "scored": self.scored}
+
+
+kb_index = MinHashIndex()
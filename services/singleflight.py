@@ -0,0 +1,79 @@
+# services/singleflight.py
+"""
+Request coalescing ("single-flight").
+
+Concurrent callers using the same key share one in-flight computation:
+the first caller (leader) runs it, the others await its result. Errors
+are propagated to every waiter. A waiter that times out falls back to
+running the computation itself. If the leader is cancelled (client gone),
+its waiters start over: the first one to resume becomes the new leader.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+# résultat posé quand le leader est annulé : les attentes recommencent
+_RETRY = object()
+
+
+class SingleFlight:
+    def __init__(self, wait_timeout: float = 10.0):
+        self.wait_timeout = wait_timeout
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.executions = 0  # calculs réellement exécutés
+        self.saved = 0       # requêtes servies par le calcul d'un autre
+        self.timeouts = 0
+        self.errors = 0
+        self.retries = 0     # attentes relancées après annulation du leader
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                return await self._lead(key, fn)
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), self.wait_timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self.executions += 1
+                return await fn()
+            if result is _RETRY:
+                self.retries += 1
+                continue
+            self.saved += 1
+            return result
+
+    async def _lead(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.executions += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # le leader est annulé (client parti) : ses attentes recommencent,
+            # la première à reprendre devient leader (le finally libère la clé avant)
+            future.set_result(_RETRY)
+            raise
+        except BaseException as exc:
+            self.errors += 1
+            future.set_exception(exc)
+            # évite "exception was never retrieved" quand personne n'attend
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._inflight),
+            "executions": self.executions,
+            "saved_executions": self.saved,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "retries": self.retries,
+        }
+
+
+singleflight = SingleFlight()
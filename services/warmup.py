@@ -0,0 +1,150 @@
+# services/warmup.py
+"""
+Startup warm-up and readiness state.
+
+Run from the app lifespan in a background thread, so the worker answers
+/healthz immediately while /readyz stays 503 until warm-up is done:
+
+1. opens WARMUP_POOL_CONNECTIONS pool connections (capped to pool size)
+2. runs the hot statements of callsession.py / agents.py / kb.py once,
+   filling SQLAlchemy's compiled-statement cache
+3. builds the OpenAPI schema and the common pydantic adapters
+4. primes the agent directory
+
+If the DB is unreachable, warm-up is retried until it succeeds. Once the
+worker is ready, the same thread signs KB entries that have no MinHash
+signature yet (services/kb_dedup.py); an advisory lock keeps it to one
+worker at a time, and it stops between batches when the worker drains.
+"""
+import logging
+import os
+import time
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from db.database import engine, SessionLocal
+from db import kb_categories, rollups
+import db.models as models
+
+logger = logging.getLogger("doxa.warmup")
+
+WARMUP_POOL_CONNECTIONS = int(os.getenv("WARMUP_POOL_CONNECTIONS", "5"))
+RETRY_SECONDS = 5
+# clé d'advisory lock : un seul worker signe les anciennes entrées KB
+_KB_BACKFILL_LOCK_KEY = 730_034
+
+
+class ReadinessState:
+    def __init__(self):
+        self.ready = False
+        self.draining = False
+        self.warmup_seconds = None
+        self.last_error = None
+
+
+state = ReadinessState()
+
+
+def _open_pool_connections() -> int:
+    count = min(WARMUP_POOL_CONNECTIONS, engine.pool.size())
+    connections = []
+    try:
+        for _ in range(count):
+            conn = engine.connect()
+            conn.execute(text("SELECT 1"))
+            connections.append(conn)
+    finally:
+        # rendues au pool, elles restent ouvertes
+        for conn in connections:
+            conn.close()
+    return count
+
+
+def _run_hot_statements(app) -> None:
+    # imports locaux : services/ ne charge pas api/ à l'import
+    from api.endpoints.agents import _leaderboard_query, agent_summaries
+    from api.endpoints.callsession import _projection_adapter, CallSessionRead
+    from services.kb_dedup import DUPLICATE_MODE, entry_signature, kb_index
+
+    CS = models.CallSession
+    now = models.utcnow()
+    db = SessionLocal()
+    try:
+        # callsession.py
+        db.query(CS).filter(CS.id == 0).first()
+        db.query(CS).order_by(CS.id.desc()).offset(0).limit(1).all()
+        db.query(CS).filter(CS.agent_id == 0).order_by(CS.id.desc()).offset(0).limit(1).all()
+        rollups.timeseries(db, now - timedelta(hours=1), now, "minute")
+
+        # agents.py (+ login / auth)
+        db.query(models.Agent).filter(models.Agent.id == 0).first()
+        db.query(models.Agent).filter(models.Agent.email == "").first()
+        db.execute(_leaderboard_query(0, 50)).all()
+
+        # kb.py
+        db.query(models.kbase_entry).filter(models.kbase_entry.id == 0).first()
+        kb_categories.facets(db)
+
+        # caches
+        agent_ids = [agent_id for (agent_id,) in db.query(models.Agent.id).limit(10_000)]
+        agent_summaries(db, agent_ids)
+        if DUPLICATE_MODE != "off":
+            kb_index.find_similar(db, entry_signature("warm-up", ""), exclude_id=0)
+    finally:
+        db.close()
+
+    # pydantic / FastAPI
+    _projection_adapter(tuple(CallSessionRead.model_fields), True)
+    _projection_adapter(("id", "agent_id", "client_type", "final_status"), False)
+    app.openapi()
+
+
+def warm_up(app) -> None:
+    """Blocking; retries until the DB answers. Meant for a worker thread."""
+    while not state.draining:
+        start = time.perf_counter()
+        try:
+            opened = _open_pool_connections()
+            _run_hot_statements(app)
+        except Exception as e:
+            state.last_error = str(e)
+            logger.warning(f"[WARMUP] failed, retrying in {RETRY_SECONDS}s: {e}")
+            time.sleep(RETRY_SECONDS)
+            continue
+        state.warmup_seconds = round(time.perf_counter() - start, 3)
+        state.last_error = None
+        state.ready = True
+        logger.info(f"[WARMUP] ready in {state.warmup_seconds}s ({opened} pool connections)")
+        _backfill_kb_signatures()
+        return
+
+
+def _backfill_kb_signatures() -> None:
+    from services.kb_dedup import DUPLICATE_MODE, kb_index
+
+    if DUPLICATE_MODE == "off":
+        return
+    try:
+        # verrou de session sur une connexion dédiée (la Session rend la
+        # sienne au pool à chaque commit)
+        with engine.connect() as lock_conn:
+            if not lock_conn.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": _KB_BACKFILL_LOCK_KEY}
+            ).scalar():
+                return
+            try:
+                db = SessionLocal()
+                try:
+                    signed = kb_index.backfill(db, should_stop=lambda: state.draining)
+                finally:
+                    db.close()
+            finally:
+                lock_conn.execute(
+                    text("SELECT pg_advisory_unlock(:key)"), {"key": _KB_BACKFILL_LOCK_KEY}
+                )
+        if signed:
+            logger.info(f"[WARMUP] kb_minhash backfilled ({signed} entries)")
+    except Exception as e:
+        # non bloquant : réessayé au prochain démarrage
+        logger.warning(f"[WARMUP] kb_minhash backfill failed: {e}")